@@ -0,0 +1,324 @@
+"""Command line tool to measure latency of performance-critical routines
+
+Example:
+    python bench.py storage
+    python bench.py storage memory sqlite
+    python bench.py normalize
+    python bench.py strategy
+"""
+from bowie import config
+from bowie import backends
+from bowie import strategy
+from bowie import twitter
+from bowie import txtools
+import argparse
+import io
+import os
+import random
+import re
+import tempfile
+import time
+
+
+def measure(func, repeat):
+    """Call function several times and return latency statistics
+
+    Args:
+        func (callable): Function to call without args
+        repeat (int): Number of calls
+
+    Returns:
+        dict: {'min': 0.0001, 'avg': 0.0002, 'max': 0.0005} (seconds)
+    """
+    latencies = []
+    for _ in range(repeat):
+        started = time.time()
+        func()
+        latencies.append(time.time() - started)
+    return {
+        'min': min(latencies),
+        'avg': sum(latencies) / len(latencies),
+        'max': max(latencies),
+    }
+
+
+def report(name, stats):
+    """Print latency statistics line
+
+    Args:
+        name (str): Measured routine name
+        stats (dict): Latency statistics (see `measure()`)
+    """
+    print('  %-32s min %8.3f ms   avg %8.3f ms   max %8.3f ms' %
+          (name, stats['min'] * 1000, stats['avg'] * 1000, stats['max'] * 1000))
+
+
+def get_sample_record(i):
+    """Build encoded sample tweet record
+
+    Args:
+        i (int): Record ordinal
+
+    Returns:
+        str
+    """
+    return twitter.encode_record({
+        'id_str': str(700000000000000000 + i),
+        'screen_name': 'user%d' % i,
+        'timestamp': 1454885884 + i,
+        'text': 'Sample tweet text number %d, long enough to look like a real one #singwithbowie' % i,
+        'hashtags': ['singwithbowie'],
+    })
+
+
+def bench_storage(names, words_count, batch_size, repeat):
+    """Measure storage backends latency on collector saver path and API views path
+
+    Args:
+        names (list of str): Backend names
+        words_count (int): Number of words (and collection items) in the sample text
+        batch_size (int): Number of items saved per saver write
+        repeat (int): Number of measured calls for each routine
+    """
+    words = ['word%d' % i for i in range(words_count)]
+    items = [get_sample_record(i) for i in range(words_count)]
+
+    for name in names:
+        # Use configured options for the backend (sqlite database is created in a temporary directory)
+        try:
+            options = config.get(name)
+        except ValueError:
+            options = {}
+        if name == 'sqlite':
+            options = dict(options, path=os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'))
+        backend = backends.create(name, options)
+
+        print('\n%s backend (%d words, saver batch of %d items)' % (name, words_count, batch_size))
+
+        # Saver path
+        backend.set_words(words, words)
+        backend.clear_upcoming_collection()
+        report('append_upcoming_items', measure(lambda: backend.append_upcoming_items(items[:batch_size]), repeat))
+        backend.clear_upcoming_collection()
+        backend.append_upcoming_items(items)
+        report('shift_collections', measure(lambda: (backend.append_upcoming_items(items[:1]),
+                                                     backend.shift_collections({'collections': 'x'})), repeat))
+
+        # Views path
+        backend.append_upcoming_items(items)
+        backend.shift_collections(twitter.build_payloads(words, items, items))
+        report('get_payload', measure(lambda: backend.get_payload('collections'), repeat))
+        report('get_words + get_collection', measure(lambda: (backend.get_words(),
+                                                              backend.get_collection('recent'),
+                                                              backend.get_collection('prev')), repeat))
+        report('page of 50 (offset 100)', measure(lambda: (backend.get_words(100, 149),
+                                                           backend.get_collection('recent', 100, 149)), repeat))
+        report('build_collections (live)', measure(lambda: twitter.build_collections(
+            backend.get_words(), backend.get_collection('recent'), backend.get_collection('prev')), repeat))
+
+
+SAMPLE_POSTS = [
+    u'We can be heroes, just for one day \U0001F31F #singwithbowie https://t.co/AbCdEf1234',
+    u'@ziggy_played_guitar Caf\u00E9 cr\u00E8me br\u00FBl\u00E9e, na\u00EFve fa\u00E7ade \u2014 d\u00E9j\u00E0 vu!',
+    u'\u00C7a va tr\u00E8s bien, merci \u00E0 tous \u2764\uFE0F https://t.co/XyZ0987654',
+    u'\u017Ditn\u00E9 r\u00E1no, \u010Derstv\u00FD chl\u00E9b a k\u00E1va. Dobr\u00FD de\u0148! #singwithbowie',
+    u'I, I will be king. And you, you will be queen \u2019cause we\u2019re lovers, and that is a fact',
+    u'Gro\u00DFe Stra\u00DFe, sch\u00F6ne Gr\u00FC\u00DFe aus K\u00F6ln @StarmanOfficial',
+]
+"""(list of unicode): Tweet-like sample texts (plain ASCII and accented words, emoji, mentions, links)"""
+
+
+def remove_diacritics_regex(text):
+    """Previous `txtools.remove_diacritics()` implementation (regex with Python replace callback), for comparison
+
+    Args:
+        text (unicode): Input text
+
+    Returns:
+        unicode
+    """
+    def choose(match):
+        char = match.group(0)
+        return txtools.diacritics_map.get(char, char)
+    return re.sub(ur'[^\u0000-\u007E]', choose, text)
+
+
+def bench_normalize(posts_count, repeat):
+    """Measure text normalization latency on tweet-like texts, against previous implementation
+
+    Args:
+        posts_count (int): Number of posts normalized per measured call
+        repeat (int): Number of measured calls for each routine
+    """
+    posts = [SAMPLE_POSTS[i % len(SAMPLE_POSTS)] + u' %d' % i for i in range(posts_count)]
+    words = [word for post in posts for word in txtools.split_to_words(post)]
+
+    # Both implementations must give the same results
+    for post in posts:
+        if txtools.remove_diacritics(post) != remove_diacritics_regex(post):
+            raise Exception('Implementations results differ: %r' % post)
+
+    print('\nnormalize (%d posts, %d words)' % (len(posts), len(words)))
+    report('remove_diacritics (regex), posts', measure(lambda: [remove_diacritics_regex(post) for post in posts],
+                                                       repeat))
+    report('remove_diacritics, posts', measure(lambda: [txtools.remove_diacritics(post) for post in posts], repeat))
+    report('normalize (regex), words', measure(lambda: [remove_diacritics_regex(word.lower()) for word in words],
+                                               repeat))
+    report('normalize (not memoized), words', measure(lambda: [txtools.remove_diacritics(word.lower())
+                                                               for word in words], repeat))
+    report('normalize, words', measure(lambda: [txtools.normalize(word) for word in words], repeat))
+
+
+class CounterSelector(object):
+    """Previous query mode switching with fixed vain requests counters, for comparison with `strategy.StrategySelector`
+    Hashtag mode is disabled after a vain request (and enabled again after a productive one),
+    focus mode is used after 5 consecutive vain requests
+    """
+    def __init__(self):
+        self.vain = 0
+        self.hashtag = True
+
+    def choose(self):
+        if self.vain >= 5:
+            return 'focus', 'vain'
+        return ('hashtag' if self.hashtag else 'plain'), 'exploit'
+
+    def record(self, mode, reason, collected):
+        if collected > 0:
+            self.vain = 0
+            self.hashtag = True
+        else:
+            self.vain += 1
+            self.hashtag = False
+
+
+def get_query_words(normalized_words, index, mode):
+    """Pack unique words following given index into query of given mode, as `twitter.assemble_collection()` does
+
+    Args:
+        normalized_words (list of unicode): Normalized words of the text
+        index (int): Index of the first word to search
+        mode (str): Query mode (see `strategy.MODES`)
+
+    Returns:
+        list of unicode: Unique query words
+    """
+    params = strategy.get_params(mode)
+    query_words = []
+    for word in normalized_words[index:]:
+        if word in query_words:
+            continue
+        if params['width'] is not None and len(query_words) >= params['width']:
+            break
+        if len(query_words) > twitter.QUERY_OPERATORS_MAX:
+            break
+        if len(query_words) > 0 and \
+                len(twitter.build_query(query_words + [word], params['hashtag'])) > twitter.QUERY_LENGTH_MAX:
+            break
+        query_words.append(word)
+    return query_words
+
+
+def simulate_collection(selector, normalized_words, rates, hashtag_share, rnd, requests_max):
+    """Simulate collection process with given query mode selector
+    Posts containing each word appear at random with the word's rate, `hashtag_share` of them having priority hashtag;
+    a search returns `ITEMS_PER_REQUEST` newest posts matching the query, and words are collected from them
+    in order, each from a post newer than the previous collected one
+
+    Args:
+        selector (strategy.StrategySelector or CounterSelector): Query mode selector
+        normalized_words (list of unicode): Normalized words of the text
+        rates (dict of unicode: float): Posts containing each word per second
+        hashtag_share (float): Share of posts having priority hashtag
+        rnd (random.Random): Random numbers generator
+        requests_max (int): Number of requests after which collection is given up
+
+    Returns:
+        int: Number of search requests made
+        dict of (str: int): Number of requests made in each mode
+    """
+    index = 0
+    now = 0.0
+    last_time = 0.0
+    requests = 0
+    modes = dict((mode, 0) for mode in strategy.MODES)
+    while index < len(normalized_words) and requests < requests_max:
+        now += twitter.REQUEST_INTERVAL
+        requests += 1
+        mode, reason = selector.choose()
+        modes[mode] += 1
+        share = hashtag_share if strategy.get_params(mode)['hashtag'] else 1.0
+        query_words = get_query_words(normalized_words, index, mode)
+
+        # Results reach back as far as the newest posts matching the query fit into one response
+        cursor = max(last_time, now - twitter.ITEMS_PER_REQUEST / sum(rates[word] * share for word in query_words))
+        collected = 0
+        while index < len(normalized_words) and normalized_words[index] in query_words:
+            cursor += rnd.expovariate(rates[normalized_words[index]] * share)
+            if cursor > now:
+                break
+            last_time = cursor
+            index += 1
+            collected += 1
+        selector.record(mode, reason, collected)
+    return requests, modes
+
+
+def bench_strategy(runs, hashtag_share, requests_max):
+    """Compare number of search requests needed to collect the sample text with yield-driven query mode selection,
+    and with previous fixed counters (see `simulate_collection()`)
+
+    Args:
+        runs (int): Number of simulated collections (each with different word rates)
+        hashtag_share (float): Share of posts having priority hashtag
+        requests_max (int): Number of requests after which collection is given up
+    """
+    with io.open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'heroes.txt'),
+                 encoding='utf-8') as f:
+        normalized_words = txtools.normalize_many(txtools.split_to_words(f.read()))
+
+    print('\nstrategy (%d words, %d runs, %.0f%% of posts with priority hashtag)' %
+          (len(normalized_words), runs, hashtag_share * 100))
+    for name, create in (('counters', CounterSelector), ('yield', strategy.StrategySelector)):
+        totals = []
+        modes = dict((mode, 0) for mode in strategy.MODES)
+        for run in range(runs):
+            # Word rates vary from a post per 5 minutes to 10 posts per second, same for both selectors in each run
+            rnd = random.Random(run)
+            rates = dict((word, 10 ** rnd.uniform(-2.5, 1)) for word in sorted(set(normalized_words)))
+            requests, run_modes = simulate_collection(create(), normalized_words, rates, hashtag_share,
+                                                      random.Random(run), requests_max)
+            totals.append(requests)
+            for mode in modes:
+                modes[mode] += run_modes[mode]
+        print('  %-10s requests min %6d   avg %8.1f   max %6d   (%s)' %
+              (name, min(totals), float(sum(totals)) / len(totals), max(totals),
+               ', '.join('%s %d%%' % (mode, 100 * modes[mode] / sum(totals)) for mode in strategy.MODES)))
+
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Measure latency of performance-critical routines')
+subparsers = parser.add_subparsers(dest='command')
+storage_parser = subparsers.add_parser('storage', help='storage backends latency')
+storage_parser.add_argument('backends', nargs='*', default=sorted(backends.BACKENDS.keys()),
+                            help='backend names (all by default)')
+storage_parser.add_argument('--words', type=int, default=1000, help='number of words in the sample text')
+storage_parser.add_argument('--batch', type=int, default=10, help='number of items saved per saver write')
+storage_parser.add_argument('--repeat', type=int, default=20, help='number of measured calls')
+normalize_parser = subparsers.add_parser('normalize', help='text normalization latency')
+normalize_parser.add_argument('--posts', type=int, default=100, help='number of posts normalized per call')
+normalize_parser.add_argument('--repeat', type=int, default=20, help='number of measured calls')
+strategy_parser = subparsers.add_parser('strategy', help='simulated search requests needed to collect the text')
+strategy_parser.add_argument('--runs', type=int, default=20, help='number of simulated collections')
+strategy_parser.add_argument('--hashtag-share', type=float, default=0.05,
+                             help='share of posts having priority hashtag')
+strategy_parser.add_argument('--requests-max', type=int, default=100000, help='requests limit per collection')
+args = parser.parse_args()
+
+if args.command == 'storage':
+    bench_storage(args.backends, args.words, args.batch, args.repeat)
+elif args.command == 'normalize':
+    bench_normalize(args.posts, args.repeat)
+elif args.command == 'strategy':
+    bench_strategy(args.runs, args.hashtag_share, args.requests_max)
+print('')
@@ -0,0 +1,41 @@
+"""Storage backends
+
+Backend is selected with `backend` param of `storage` config section (see `bowie.storage.get_backend()`):
+    redis   Redis server (default), see `bowie.backends.redisdb`
+    memory  In-process memory, see `bowie.backends.memory`
+    sqlite  SQLite database file in WAL mode, see `bowie.backends.sqlite`
+"""
+import importlib
+
+
+BACKENDS = {
+    'redis': ('bowie.backends.redisdb', 'RedisBackend'),
+    'memory': ('bowie.backends.memory', 'MemoryBackend'),
+    'sqlite': ('bowie.backends.sqlite', 'SqliteBackend'),
+}
+"""(dict of str: tuple): Backend classes by name: {'name': ('module.path', 'ClassName')}"""
+
+DEFAULT_BACKEND = 'redis'
+
+
+def create(name, options=None):
+    """Create storage backend instance
+
+    Args:
+        name (str): Backend name (see `BACKENDS`)
+        options (dict=None): Backend options (usually the backend's config section)
+
+    Returns:
+        bowie.backends.base.Backend
+
+    Raises:
+        ValueError: Unknown storage backend
+    """
+    try:
+        module_name, class_name = BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown storage backend: "%s"' % name)
+
+    # Import backend module only when requested (so unused backend dependencies are not required)
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)(options or {})
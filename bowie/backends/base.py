@@ -0,0 +1,217 @@
+"""Storage backend interface"""
+
+
+PREV_COLLECTION = 'prev'
+RECENT_COLLECTION = 'recent'
+UPCOMING_COLLECTION = 'upcoming'
+COLLECTIONS = (PREV_COLLECTION, RECENT_COLLECTION, UPCOMING_COLLECTION)
+
+PAYLOAD_NAMES = ('collections', 'stat')
+"""(tuple of str): Names of pre-rendered API payloads stored per collection generation"""
+
+
+class Backend(object):
+    """Base class for storage backends
+
+    List ranges follow redis LRANGE semantics: `stop` index is inclusive, negative indexes count from the end
+    Stored strings are returned as UTF-8 encoded `str`, whatever type was written
+
+    Args:
+        options (dict): Backend options (usually the backend's config section, values are strings)
+    """
+    def __init__(self, options):
+        self.options = options
+
+    def get_words(self, start=0, stop=-1):
+        """Get words list range
+
+        Returns:
+            list of str
+        """
+        raise NotImplementedError
+
+    def set_words(self, words, normalized):
+        """Replace words list, along with normalized words list
+
+        Args:
+            words (list of str) or (list of unicode)
+            normalized (list of unicode): Normalized words, aligned with `words`
+        """
+        raise NotImplementedError
+
+    def stage_words(self, words, normalized):
+        """Append words to staging words list, which replaces words list on `commit_staged_words()` call
+        (used to import long texts in chunks, see `storage.import_words()`)
+
+        Args:
+            words (list of str) or (list of unicode)
+            normalized (list of unicode): Normalized words, aligned with `words`
+        """
+        raise NotImplementedError
+
+    def commit_staged_words(self):
+        """Replace words list and normalized words list with staging ones atomically (staging lists are emptied)"""
+        raise NotImplementedError
+
+    def discard_staged_words(self):
+        """Empty staging words lists"""
+        raise NotImplementedError
+
+    def get_normalized_words(self, start=0, stop=-1):
+        """Get normalized words list range
+
+        Returns:
+            list of str
+        """
+        raise NotImplementedError
+
+    def get_collection(self, name, start=0, stop=-1):
+        """Get collection items range
+
+        Args:
+            name (str): Collection name (see `COLLECTIONS`)
+
+        Returns:
+            list of str
+        """
+        raise NotImplementedError
+
+    def append_upcoming_items(self, items, checkpoint=None):
+        """Add items to upcoming collection, keeping their order, and replace collection process checkpoint
+        All or none of the items are saved, together with the checkpoint
+
+        Args:
+            items (list of str)
+            checkpoint (str=None): Serialized checkpoint (not replaced if None)
+        """
+        raise NotImplementedError
+
+    def get_checkpoint(self):
+        """Get collection process checkpoint
+
+        Returns:
+            str or None: Serialized checkpoint
+        """
+        raise NotImplementedError
+
+    def clear_upcoming_collection(self):
+        """Remove all items from upcoming collection, and collection process checkpoint"""
+        raise NotImplementedError
+
+    def shift_collections(self, payloads, archive_size=0, archive_max_age=0):
+        """Atomically replace "prev" collection with "recent" one (if exists) and "recent" one with "upcoming"
+        Increment collection generation, store given payloads for the new generation and drop the older ones
+        Collection process checkpoint is removed
+        Overwritten "prev" collection is moved to archive, and archive is trimmed to given size and age
+
+        Args:
+            payloads (dict of str: str): Pre-rendered API payloads by name (see `PAYLOAD_NAMES`)
+            archive_size (int=0): Maximum number of archived collections (0 disables archive)
+            archive_max_age (int=0): Maximum seconds since collection was archived (0 means no age limit)
+
+        Returns:
+            int: New collection generation
+
+        Raises:
+            ValueError: Upcoming collection does not exist
+        """
+        raise NotImplementedError
+
+    def get_archive(self):
+        """Get archived collections list, newest first
+
+        Returns:
+            list of tuple: [(generation, archived_at), ...], e.g. [(12, 1454885884), (11, 1454799484)]
+        """
+        raise NotImplementedError
+
+    def get_generation_collection(self, generation, start=0, stop=-1):
+        """Get items range of collection by its generation ("recent", "prev" or archived one)
+
+        Args:
+            generation (int): Collection generation
+
+        Returns:
+            list of str or None: Collection items (None if generation is unknown)
+        """
+        raise NotImplementedError
+
+    def get_generation(self):
+        """Get current collection generation
+
+        Returns:
+            int: Generation number (0 if collections were never shifted)
+        """
+        raise NotImplementedError
+
+    def get_payload(self, name):
+        """Get pre-rendered API payload stored for current collection generation
+
+        Returns:
+            str or None
+        """
+        raise NotImplementedError
+
+    def acquire_token(self, bucket, rate, capacity):
+        """Take a token from rate limiting bucket shared by all processes using the storage (see `take_token()`)
+        Bucket is created full on first use
+
+        Args:
+            bucket (str): Bucket name
+            rate (float): Tokens added to the bucket per second
+            capacity (int): Maximum number of tokens in the bucket
+
+        Returns:
+            float: 0 if token was taken, otherwise seconds to wait before the next attempt
+        """
+        raise NotImplementedError
+
+
+def to_str(value):
+    """Encode unicode value to UTF-8 `str` (other values are converted with `str()`)
+
+    Args:
+        value (str or unicode or int)
+
+    Returns:
+        str
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return str(value)
+
+
+def take_token(tokens, updated_at, now, rate, capacity):
+    """Refill token bucket for the time passed since its last update, then take a token from it if there is one
+
+    Args:
+        tokens (float or None): Tokens in the bucket at the last update (None if bucket does not exist yet)
+        updated_at (float or None): UTC epoch time of the last update
+        now (float): Current UTC epoch time
+        rate (float): Tokens added to the bucket per second
+        capacity (int): Maximum number of tokens in the bucket
+
+    Returns:
+        tuple: (tokens left, seconds to wait before the next attempt or 0 if token was taken)
+    """
+    if tokens is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + max(0, now - updated_at) * rate)
+
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+def get_slice(start, stop):
+    """Convert LRANGE-like range to slice object
+
+    Args:
+        start (int): Index of the first item
+        stop (int): Index of the last item, inclusive (-1 means the end of the list)
+
+    Returns:
+        slice
+    """
+    return slice(start, stop + 1 if stop != -1 else None)
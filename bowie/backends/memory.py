@@ -0,0 +1,134 @@
+"""In-process memory storage backend
+Data lives only as long as the process does, so it is meant for single-process runs, benchmarks and tests
+"""
+from bowie.backends import base
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend(base.Backend):
+    """In-process memory storage backend (thread-safe, no options)"""
+    def __init__(self, options):
+        super(MemoryBackend, self).__init__(options)
+        self._lock = threading.Lock()
+        self._words = []
+        self._normalized_words = []
+        self._staged_words = []
+        self._staged_normalized_words = []
+        self._collections = {}
+        self._generation = 0
+        self._payloads = {}
+        self._archive = OrderedDict()
+        self._checkpoint = None
+        self._buckets = {}
+
+    def get_words(self, start=0, stop=-1):
+        with self._lock:
+            return self._words[base.get_slice(start, stop)]
+
+    def set_words(self, words, normalized):
+        words = [base.to_str(word) for word in words]
+        normalized = [base.to_str(word) for word in normalized]
+        with self._lock:
+            self._words = words
+            self._normalized_words = normalized
+
+    def stage_words(self, words, normalized):
+        words = [base.to_str(word) for word in words]
+        normalized = [base.to_str(word) for word in normalized]
+        with self._lock:
+            self._staged_words.extend(words)
+            self._staged_normalized_words.extend(normalized)
+
+    def commit_staged_words(self):
+        with self._lock:
+            self._words = self._staged_words
+            self._normalized_words = self._staged_normalized_words
+            self._staged_words = []
+            self._staged_normalized_words = []
+
+    def discard_staged_words(self):
+        with self._lock:
+            self._staged_words = []
+            self._staged_normalized_words = []
+
+    def get_normalized_words(self, start=0, stop=-1):
+        with self._lock:
+            return self._normalized_words[base.get_slice(start, stop)]
+
+    def get_collection(self, name, start=0, stop=-1):
+        with self._lock:
+            return self._collections.get(name, [])[base.get_slice(start, stop)]
+
+    def append_upcoming_items(self, items, checkpoint=None):
+        items = [base.to_str(item) for item in items]
+        with self._lock:
+            self._collections.setdefault(base.UPCOMING_COLLECTION, []).extend(items)
+            if checkpoint is not None:
+                self._checkpoint = base.to_str(checkpoint)
+
+    def get_checkpoint(self):
+        with self._lock:
+            return self._checkpoint
+
+    def clear_upcoming_collection(self):
+        with self._lock:
+            self._collections.pop(base.UPCOMING_COLLECTION, None)
+            self._checkpoint = None
+
+    def shift_collections(self, payloads, archive_size=0, archive_max_age=0):
+        now = int(time.time())
+        with self._lock:
+            if base.UPCOMING_COLLECTION not in self._collections:
+                raise ValueError('upcoming collection does not exist')
+            if base.RECENT_COLLECTION in self._collections:
+                if archive_size > 0 and self._generation > 1 and base.PREV_COLLECTION in self._collections:
+                    self._archive[self._generation - 1] = (now, self._collections[base.PREV_COLLECTION])
+                self._collections[base.PREV_COLLECTION] = self._collections.pop(base.RECENT_COLLECTION)
+            self._collections[base.RECENT_COLLECTION] = self._collections.pop(base.UPCOMING_COLLECTION)
+            self._checkpoint = None
+
+            # Trim archive (items are kept in archive order, oldest first)
+            while len(self._archive) > archive_size:
+                self._archive.popitem(last=False)
+            if archive_max_age > 0:
+                for generation, (archived_at, _) in self._archive.items():
+                    if archived_at < now - archive_max_age:
+                        del self._archive[generation]
+
+            self._generation += 1
+            self._payloads = dict((name, base.to_str(payload)) for name, payload in payloads.items() if payload)
+            return self._generation
+
+    def get_archive(self):
+        with self._lock:
+            return [(generation, archived_at) for generation, (archived_at, _) in reversed(self._archive.items())]
+
+    def get_generation_collection(self, generation, start=0, stop=-1):
+        with self._lock:
+            if generation == self._generation:
+                items = self._collections.get(base.RECENT_COLLECTION, [])
+            elif generation == self._generation - 1:
+                items = self._collections.get(base.PREV_COLLECTION, [])
+            elif generation in self._archive:
+                items = self._archive[generation][1]
+            else:
+                return None
+            return items[base.get_slice(start, stop)]
+
+    def get_generation(self):
+        with self._lock:
+            return self._generation
+
+    def get_payload(self, name):
+        with self._lock:
+            return self._payloads.get(name)
+
+    def acquire_token(self, bucket, rate, capacity):
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self._buckets.get(bucket, (None, None))
+            tokens, wait = base.take_token(tokens, updated_at, now, rate, capacity)
+            self._buckets[bucket] = (tokens, now)
+            return wait
@@ -0,0 +1,404 @@
+"""Redis storage backend"""
+from bowie import config
+from bowie.backends import base
+import redis
+import os
+import threading
+import time
+
+
+WORDS_LIST_KEY = 'words'
+NORMALIZED_WORDS_LIST_KEY = 'words:normalized'
+STAGING_KEY_SUFFIX = ':staging'
+PREV_COLLECTION_LIST_KEY = 'prev'
+RECENT_COLLECTION_LIST_KEY = 'recent'
+UPCOMING_COLLECTION_LIST_KEY = 'upcoming'
+GENERATION_KEY = 'generation'
+CHECKPOINT_KEY = 'checkpoint'
+PAYLOAD_KEY_PREFIX = 'payload:'
+ARCHIVE_INDEX_KEY = 'archive'
+ARCHIVE_KEY_PREFIX = 'archive:'
+BUCKET_KEY_PREFIX = 'bucket:'
+APPEND_CHUNK_SIZE = 1000
+
+COLLECTION_KEYS = {
+    base.PREV_COLLECTION: PREV_COLLECTION_LIST_KEY,
+    base.RECENT_COLLECTION: RECENT_COLLECTION_LIST_KEY,
+    base.UPCOMING_COLLECTION: UPCOMING_COLLECTION_LIST_KEY,
+}
+
+SHIFT_COLLECTIONS_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    return redis.error_reply('upcoming collection does not exist')
+end
+local current = tonumber(redis.call('GET', KEYS[4]) or '0')
+local archive_size = tonumber(ARGV[3])
+local archive_max_age = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    if archive_size > 0 and current > 1 and redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('RENAME', KEYS[1], ARGV[2] .. (current - 1))
+        redis.call('ZADD', KEYS[5], now, current - 1)
+    end
+    redis.call('RENAME', KEYS[2], KEYS[1])
+end
+redis.call('RENAME', KEYS[3], KEYS[2])
+local evicted = redis.call('ZRANGE', KEYS[5], 0, -(archive_size + 1))
+if archive_max_age > 0 then
+    for _, generation in ipairs(redis.call('ZRANGEBYSCORE', KEYS[5], '-inf', '(' .. (now - archive_max_age))) do
+        table.insert(evicted, generation)
+    end
+end
+redis.call('DEL', KEYS[6])
+for _, generation in ipairs(evicted) do
+    redis.call('DEL', ARGV[2] .. generation)
+    redis.call('ZREM', KEYS[5], generation)
+end
+local generation = redis.call('INCR', KEYS[4])
+for i = 6, #ARGV, 2 do
+    redis.call('DEL', ARGV[1] .. (generation - 1) .. ':' .. ARGV[i])
+    if ARGV[i + 1] ~= '' then
+        redis.call('SET', ARGV[1] .. generation .. ':' .. ARGV[i], ARGV[i + 1])
+    end
+end
+return generation
+"""
+"""(str): Lua script rotating collections: KEYS = [prev, recent, upcoming, generation, archive index, checkpoint]
+   "recent" may not exist on the first rotation (then "prev" is kept), "upcoming" must exist
+   Overwritten "prev" collection is renamed to archive key and added to archive index (scored by archive time),
+   archived collections exceeding archive size or max age are removed, collection process checkpoint is removed
+   ARGV = [payload key prefix, archive key prefix, archive size, archive max age, current time,
+           name1, payload1, name2, payload2, ...]: payloads stored for the new generation
+   (previous generation payloads are removed, empty payload is not stored)
+"""
+
+GET_GENERATION_COLLECTION_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local generation = tonumber(ARGV[2])
+local key
+if generation == current then
+    key = KEYS[2]
+elseif generation == current - 1 then
+    key = KEYS[3]
+elseif redis.call('ZSCORE', KEYS[4], ARGV[2]) then
+    key = ARGV[1] .. ARGV[2]
+else
+    return false
+end
+return redis.call('LRANGE', key, ARGV[3], ARGV[4])
+"""
+"""(str): Lua script getting collection items range by generation: KEYS = [generation, recent, prev, archive index],
+   ARGV = [archive key prefix, generation, start, stop]; returns nil for unknown generation
+"""
+
+GET_PAYLOAD_SCRIPT = """
+local generation = redis.call('GET', KEYS[1])
+if not generation then
+    return nil
+end
+return redis.call('GET', ARGV[1] .. generation .. ':' .. ARGV[2])
+"""
+"""(str): Lua script getting payload for current generation: KEYS = [generation], ARGV = [key prefix, name]"""
+
+ACQUIRE_TOKEN_SCRIPT = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+"""(str): Lua script taking a token from rate limiting bucket: KEYS = [bucket], ARGV = [rate, capacity]
+   Redis server time is used, so collectors on different hosts share the bucket regardless of their clocks
+   Bucket expires when it would be full again (the same as non-existent one); returns seconds to wait (0 if taken)
+"""
+
+COMMIT_STAGED_WORDS_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 1])
+    else
+        redis.call('DEL', KEYS[i + 1])
+    end
+end
+return true
+"""
+"""(str): Lua script replacing keys with staging ones: KEYS = [staging key 1, key 1, staging key 2, key 2, ...]
+   (a key is removed if its staging key does not exist, i.e. staging list is empty)
+"""
+
+POOL_PARAMS = {
+    'port': int,
+    'db': int,
+    'max_connections': int,
+    'timeout': float,
+    'socket_timeout': float,
+    'socket_connect_timeout': float,
+    'socket_keepalive': config.parse_bool,
+    'retry_on_timeout': config.parse_bool,
+    'health_check_interval': int,
+}
+"""(dict of str: callable): Redis connection pool params to be converted from config strings"""
+
+POOL_DEFAULTS = {
+    'max_connections': 16,
+    'timeout': 5,
+    'socket_timeout': 10,
+    'socket_connect_timeout': 5,
+    'socket_keepalive': True,
+    'retry_on_timeout': True,
+    'health_check_interval': 30,
+}
+"""(dict of str: int or float or bool): Default pool params, can be overridden in `redis` config section
+   `max_connections`: pool size (callers wait up to `timeout` seconds for a free connection when exceeded)
+   `health_check_interval`: idle connections are PINGed before reuse, broken ones are reconnected
+"""
+
+
+class RedisBackend(base.Backend):
+    """Redis storage backend
+    Options are connection and pool params (see `POOL_DEFAULTS`), read from `redis` config section
+    """
+    def __init__(self, options):
+        super(RedisBackend, self).__init__(options)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._scripts = {}
+
+    def get_conn(self):
+        """Return redis instance bound to the shared connection pool
+
+        Raises:
+            Exception: Cannot get redis connection pool
+            Exception: Cannot establish redis connection
+        """
+        # Get process-wide connection pool
+        try:
+            pool = self.get_pool()
+        except BaseException as ex:
+            raise Exception('Cannot get redis connection pool: %s' % ex)
+
+        # Bind redis instance to the pool (no connection is opened until the first command)
+        try:
+            rds = redis.StrictRedis(connection_pool=pool)
+        except BaseException as ex:
+            raise Exception('Cannot establish redis connection: %s' % ex)
+
+        # Return redis instance
+        return rds
+
+    def get_pool(self):
+        """Get process-wide redis connection pool, creating it on first call or after fork
+
+        Pool is shared between all threads of the process (Flask views, collector fetchers and saver)
+        A forked child process never reuses parent's sockets: a new pool is created for it instead
+
+        Returns:
+            redis.ConnectionPool
+
+        Raises:
+            Exception: Wrong redis pool configuration
+            Exception: Cannot create redis connection pool
+        """
+        pid = os.getpid()
+        if self._pool is not None and self._pool_pid == pid:
+            return self._pool
+
+        with self._pool_lock:
+            # Other thread may have created the pool while we were waiting for the lock
+            if self._pool is not None and self._pool_pid == pid:
+                return self._pool
+
+            # Convert pool params (config values are read as strings)
+            params = dict(POOL_DEFAULTS)
+            params.update(self.options)
+            try:
+                for param, cast in POOL_PARAMS.items():
+                    if param in params:
+                        params[param] = cast(params[param])
+            except BaseException as ex:
+                raise Exception('Wrong redis pool configuration: %s' % ex)
+
+            # Create the pool
+            try:
+                self._pool = redis.BlockingConnectionPool(**params)
+            except BaseException as ex:
+                raise Exception('Cannot create redis connection pool: %s' % ex)
+            self._pool_pid = pid
+
+        return self._pool
+
+    def get_script(self, source):
+        """Get registered Lua script object for given source (scripts are cached by SHA on the server side)
+
+        Args:
+            source (str) Lua script source
+
+        Returns:
+            redis.client.Script
+        """
+        if source not in self._scripts:
+            self._scripts[source] = self.get_conn().register_script(source)
+        return self._scripts[source]
+
+    def get_members(self, key, start=0, stop=-1):
+        """Wrapper method for getting members of specified list (all members by default)
+
+        Args:
+            key (str) Name of redis list
+            start (int=0) Index of the first member to get
+            stop (int=-1) Index of the last member to get, inclusive (negative index counts from the end)
+        """
+        # Get members of the list
+        try:
+            members = self.get_conn().lrange(key, start, stop)
+        except BaseException as ex:
+            raise Exception('Cannot get `%s` list from redis: %s' % (key, ex))
+
+        # Return obtained members
+        return members
+
+    def get_words(self, start=0, stop=-1):
+        return self.get_members(WORDS_LIST_KEY, start, stop)
+
+    def set_words(self, words, normalized):
+        # Lists are replaced within one MULTI/EXEC, written in chunks of `APPEND_CHUNK_SIZE`
+        try:
+            pipe = self.get_conn().pipeline(transaction=True)
+            pipe.delete(WORDS_LIST_KEY, NORMALIZED_WORDS_LIST_KEY)
+            for offset in range(0, len(words), APPEND_CHUNK_SIZE):
+                pipe.rpush(WORDS_LIST_KEY, *words[offset:offset + APPEND_CHUNK_SIZE])
+                pipe.rpush(NORMALIZED_WORDS_LIST_KEY, *normalized[offset:offset + APPEND_CHUNK_SIZE])
+            pipe.execute()
+        except BaseException as ex:
+            raise Exception('Cannot write new words list to redis: %s' % ex)
+
+    def stage_words(self, words, normalized):
+        # Chunks are pipelined without MULTI/EXEC, so the server is not blocked by a long transaction
+        try:
+            pipe = self.get_conn().pipeline(transaction=False)
+            for offset in range(0, len(words), APPEND_CHUNK_SIZE):
+                pipe.rpush(WORDS_LIST_KEY + STAGING_KEY_SUFFIX, *words[offset:offset + APPEND_CHUNK_SIZE])
+                pipe.rpush(NORMALIZED_WORDS_LIST_KEY + STAGING_KEY_SUFFIX,
+                           *normalized[offset:offset + APPEND_CHUNK_SIZE])
+            pipe.execute()
+        except BaseException as ex:
+            raise Exception('Cannot write staging words list to redis: %s' % ex)
+
+    def commit_staged_words(self):
+        # Both lists are swapped at once (see `COMMIT_STAGED_WORDS_SCRIPT`)
+        rds = self.get_conn()
+        try:
+            self.get_script(COMMIT_STAGED_WORDS_SCRIPT)(
+                keys=[key + suffix for key in (WORDS_LIST_KEY, NORMALIZED_WORDS_LIST_KEY)
+                      for suffix in (STAGING_KEY_SUFFIX, '')],
+                client=rds)
+        except BaseException as ex:
+            raise Exception('Cannot replace words list with staging one in redis: %s' % ex)
+
+    def discard_staged_words(self):
+        try:
+            self.get_conn().delete(WORDS_LIST_KEY + STAGING_KEY_SUFFIX, NORMALIZED_WORDS_LIST_KEY + STAGING_KEY_SUFFIX)
+        except BaseException as ex:
+            raise Exception('Cannot clear staging words list in redis: %s' % ex)
+
+    def get_normalized_words(self, start=0, stop=-1):
+        return self.get_members(NORMALIZED_WORDS_LIST_KEY, start, stop)
+
+    def get_collection(self, name, start=0, stop=-1):
+        return self.get_members(COLLECTION_KEYS[name], start, stop)
+
+    def append_upcoming_items(self, items, checkpoint=None):
+        # Items are written in chunks of `APPEND_CHUNK_SIZE` within one MULTI/EXEC, with a single round-trip
+        try:
+            pipe = self.get_conn().pipeline(transaction=True)
+            for offset in range(0, len(items), APPEND_CHUNK_SIZE):
+                pipe.rpush(UPCOMING_COLLECTION_LIST_KEY, *items[offset:offset + APPEND_CHUNK_SIZE])
+            if checkpoint is not None:
+                pipe.set(CHECKPOINT_KEY, checkpoint)
+            pipe.execute()
+        except BaseException as ex:
+            raise Exception('Cannot write new upcoming items to redis: %s' % ex)
+
+    def get_checkpoint(self):
+        try:
+            checkpoint = self.get_conn().get(CHECKPOINT_KEY)
+        except BaseException as ex:
+            raise Exception('Cannot get checkpoint from redis: %s' % ex)
+
+        return checkpoint
+
+    def clear_upcoming_collection(self):
+        try:
+            self.get_conn().delete(UPCOMING_COLLECTION_LIST_KEY, CHECKPOINT_KEY)
+        except BaseException as ex:
+            raise Exception('Cannot clear upcoming collection in redis: %s' % ex)
+
+    def shift_collections(self, payloads, archive_size=0, archive_max_age=0):
+        # Rotation is done in a single round-trip (see `SHIFT_COLLECTIONS_SCRIPT`)
+        rds = self.get_conn()
+        try:
+            generation = self.get_script(SHIFT_COLLECTIONS_SCRIPT)(
+                keys=[PREV_COLLECTION_LIST_KEY, RECENT_COLLECTION_LIST_KEY, UPCOMING_COLLECTION_LIST_KEY,
+                      GENERATION_KEY, ARCHIVE_INDEX_KEY, CHECKPOINT_KEY],
+                args=[PAYLOAD_KEY_PREFIX, ARCHIVE_KEY_PREFIX, archive_size, archive_max_age, int(time.time())] +
+                     [value for name in base.PAYLOAD_NAMES for value in (name, payloads.get(name, ''))],
+                client=rds)
+        except redis.ResponseError as ex:
+            raise ValueError(str(ex))
+
+        return int(generation)
+
+    def get_archive(self):
+        try:
+            archive = self.get_conn().zrevrange(ARCHIVE_INDEX_KEY, 0, -1, withscores=True)
+        except BaseException as ex:
+            raise Exception('Cannot get collections archive index from redis: %s' % ex)
+
+        return [(int(generation), int(archived_at)) for generation, archived_at in archive]
+
+    def get_generation_collection(self, generation, start=0, stop=-1):
+        # Generation lookup and items read are done in a single round-trip (see `GET_GENERATION_COLLECTION_SCRIPT`)
+        rds = self.get_conn()
+        return self.get_script(GET_GENERATION_COLLECTION_SCRIPT)(
+            keys=[GENERATION_KEY, RECENT_COLLECTION_LIST_KEY, PREV_COLLECTION_LIST_KEY, ARCHIVE_INDEX_KEY],
+            args=[ARCHIVE_KEY_PREFIX, generation, start, stop],
+            client=rds)
+
+    def get_generation(self):
+        try:
+            generation = self.get_conn().get(GENERATION_KEY)
+        except BaseException as ex:
+            raise Exception('Cannot get collection generation from redis: %s' % ex)
+
+        return int(generation or 0)
+
+    def get_payload(self, name):
+        # Generation lookup and payload read are done in a single round-trip (see `GET_PAYLOAD_SCRIPT`)
+        rds = self.get_conn()
+        return self.get_script(GET_PAYLOAD_SCRIPT)(keys=[GENERATION_KEY], args=[PAYLOAD_KEY_PREFIX, name], client=rds)
+
+    def acquire_token(self, bucket, rate, capacity):
+        # Bucket refill and token take are done atomically on the server side (see `ACQUIRE_TOKEN_SCRIPT`)
+        rds = self.get_conn()
+        wait = self.get_script(ACQUIRE_TOKEN_SCRIPT)(keys=[BUCKET_KEY_PREFIX + bucket], args=[rate, capacity],
+                                                     client=rds)
+        return float(wait)
@@ -0,0 +1,271 @@
+"""SQLite storage backend
+Database file is opened in WAL mode, so views can read while the collector writes
+"""
+from bowie.backends import base
+import sqlite3
+import os
+import threading
+import time
+
+
+DEFAULT_PATH = 'bowie.sqlite3'
+DEFAULT_TIMEOUT = 10
+SYNCHRONOUS_VALUES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS words (position INTEGER PRIMARY KEY, word TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS normalized_words (position INTEGER PRIMARY KEY, word TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS staged_words (position INTEGER PRIMARY KEY, word TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS staged_normalized_words (position INTEGER PRIMARY KEY, word TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS items (collection TEXT NOT NULL, position INTEGER NOT NULL, data TEXT NOT NULL, '
+    'PRIMARY KEY (collection, position))',
+    'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS archive (generation INTEGER PRIMARY KEY, archived_at INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)',
+]
+"""(list of str): Tables: `words` list with `normalized_words` (and their `staged_*` counterparts being imported),
+   `items` of all collections, `meta` values (generation and payloads),
+   `archive` index (items of archived collections are stored with `archive:<generation>` collection name),
+   rate limiting token `buckets`
+"""
+
+GENERATION_META = 'generation'
+CHECKPOINT_META = 'checkpoint'
+PAYLOAD_META_PREFIX = 'payload:'
+ARCHIVE_COLLECTION_PREFIX = 'archive:'
+
+
+class SqliteBackend(base.Backend):
+    """SQLite storage backend
+
+    Options:
+        path (str='bowie.sqlite3'): Database file path (relative to current working directory)
+        timeout (float=10): Seconds to wait for a lock held by other connection
+        synchronous (str='NORMAL'): SQLite `synchronous` pragma value
+    """
+    def __init__(self, options):
+        super(SqliteBackend, self).__init__(options)
+        self.path = os.path.join(os.getcwd(), options.get('path', DEFAULT_PATH))
+        self.timeout = float(options.get('timeout', DEFAULT_TIMEOUT))
+        self.synchronous = options.get('synchronous', 'NORMAL').upper()
+        if self.synchronous not in SYNCHRONOUS_VALUES:
+            raise ValueError('Wrong sqlite `synchronous` option value: "%s"' % self.synchronous)
+        self._local = threading.local()
+
+    def get_conn(self):
+        """Get database connection for current thread (and process), creating it and the schema if needed
+
+        Returns:
+            sqlite3.Connection
+        """
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.text_factory = str
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=%s' % self.synchronous)
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def transaction(self):
+        """Begin write transaction on current thread's connection
+
+        Returns:
+            sqlite3.Connection: Connection in transaction (use as context manager to commit or rollback)
+        """
+        conn = self.get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        return Transaction(conn)
+
+    def get_range(self, query, count_query, args, start, stop):
+        """Run positional range query, resolving LRANGE-like negative indexes
+
+        Args:
+            query (str): Query selecting values with `position BETWEEN ? AND ?` condition
+            count_query (str): Query counting all items of the list
+            args (tuple): Query args preceding range bounds
+            start (int): Index of the first item
+            stop (int): Index of the last item, inclusive (negative index counts from the end)
+
+        Returns:
+            list of str
+        """
+        conn = self.get_conn()
+        if start < 0 or stop < -1:
+            length = conn.execute(count_query, args).fetchone()[0]
+            start = max(start + length, 0) if start < 0 else start
+            stop = stop + length if stop < 0 else stop
+        elif stop == -1:
+            stop = 2 ** 62
+        return [row[0] for row in conn.execute(query, args + (start, stop))]
+
+    def get_words(self, start=0, stop=-1):
+        return self.get_range('SELECT word FROM words WHERE position BETWEEN ? AND ? ORDER BY position',
+                              'SELECT COUNT(*) FROM words', (), start, stop)
+
+    def set_words(self, words, normalized):
+        with self.transaction() as conn:
+            for table, table_words in (('words', words), ('normalized_words', normalized)):
+                conn.execute('DELETE FROM %s' % table)
+                conn.executemany('INSERT INTO %s (position, word) VALUES (?, ?)' % table,
+                                 ((position, base.to_str(word)) for position, word in enumerate(table_words)))
+
+    def stage_words(self, words, normalized):
+        with self.transaction() as conn:
+            offset = conn.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM staged_words').fetchone()[0]
+            for table, table_words in (('staged_words', words), ('staged_normalized_words', normalized)):
+                conn.executemany('INSERT INTO %s (position, word) VALUES (?, ?)' % table,
+                                 ((offset + i, base.to_str(word)) for i, word in enumerate(table_words)))
+
+    def commit_staged_words(self):
+        # Staged words are copied within one transaction, so readers see either previous words or new ones
+        with self.transaction() as conn:
+            for table, staged_table in (('words', 'staged_words'), ('normalized_words', 'staged_normalized_words')):
+                conn.execute('DELETE FROM %s' % table)
+                conn.execute('INSERT INTO %s (position, word) SELECT position, word FROM %s' % (table, staged_table))
+                conn.execute('DELETE FROM %s' % staged_table)
+
+    def discard_staged_words(self):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM staged_words')
+            conn.execute('DELETE FROM staged_normalized_words')
+
+    def get_normalized_words(self, start=0, stop=-1):
+        return self.get_range('SELECT word FROM normalized_words WHERE position BETWEEN ? AND ? ORDER BY position',
+                              'SELECT COUNT(*) FROM normalized_words', (), start, stop)
+
+    def get_collection(self, name, start=0, stop=-1):
+        return self.get_range('SELECT data FROM items WHERE collection = ? AND position BETWEEN ? AND ? '
+                              'ORDER BY position',
+                              'SELECT COUNT(*) FROM items WHERE collection = ?', (name,), start, stop)
+
+    def append_upcoming_items(self, items, checkpoint=None):
+        with self.transaction() as conn:
+            offset = conn.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM items WHERE collection = ?',
+                                  (base.UPCOMING_COLLECTION,)).fetchone()[0]
+            conn.executemany('INSERT INTO items (collection, position, data) VALUES (?, ?, ?)',
+                             ((base.UPCOMING_COLLECTION, offset + i, base.to_str(item))
+                              for i, item in enumerate(items)))
+            if checkpoint is not None:
+                conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                             (CHECKPOINT_META, base.to_str(checkpoint)))
+
+    def get_checkpoint(self):
+        row = self.get_conn().execute('SELECT value FROM meta WHERE name = ?', (CHECKPOINT_META,)).fetchone()
+        return row[0] if row is not None else None
+
+    def clear_upcoming_collection(self):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM items WHERE collection = ?', (base.UPCOMING_COLLECTION,))
+            conn.execute('DELETE FROM meta WHERE name = ?', (CHECKPOINT_META,))
+
+    def shift_collections(self, payloads, archive_size=0, archive_max_age=0):
+        now = int(time.time())
+        with self.transaction() as conn:
+            if not self.has_collection(base.UPCOMING_COLLECTION):
+                raise ValueError('upcoming collection does not exist')
+            current = self.get_generation()
+            if self.has_collection(base.RECENT_COLLECTION):
+                if archive_size > 0 and current > 1 and self.has_collection(base.PREV_COLLECTION):
+                    conn.execute('UPDATE items SET collection = ? WHERE collection = ?',
+                                 (ARCHIVE_COLLECTION_PREFIX + str(current - 1), base.PREV_COLLECTION))
+                    conn.execute('INSERT OR REPLACE INTO archive (generation, archived_at) VALUES (?, ?)',
+                                 (current - 1, now))
+                else:
+                    conn.execute('DELETE FROM items WHERE collection = ?', (base.PREV_COLLECTION,))
+                conn.execute('UPDATE items SET collection = ? WHERE collection = ?',
+                             (base.PREV_COLLECTION, base.RECENT_COLLECTION))
+            conn.execute('UPDATE items SET collection = ? WHERE collection = ?',
+                         (base.RECENT_COLLECTION, base.UPCOMING_COLLECTION))
+            conn.execute('DELETE FROM meta WHERE name = ?', (CHECKPOINT_META,))
+
+            # Trim archive
+            evicted = [row[0] for row in conn.execute(
+                'SELECT generation FROM archive WHERE generation NOT IN '
+                '(SELECT generation FROM archive ORDER BY generation DESC LIMIT ?) OR (? > 0 AND archived_at < ?)',
+                (archive_size, archive_max_age, now - archive_max_age))]
+            for generation in evicted:
+                conn.execute('DELETE FROM items WHERE collection = ?', (ARCHIVE_COLLECTION_PREFIX + str(generation),))
+                conn.execute('DELETE FROM archive WHERE generation = ?', (generation,))
+
+            generation = current + 1
+            conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (GENERATION_META, generation))
+            conn.execute('DELETE FROM meta WHERE name LIKE ?', (PAYLOAD_META_PREFIX + '%',))
+            conn.executemany('INSERT INTO meta (name, value) VALUES (?, ?)',
+                             ((PAYLOAD_META_PREFIX + name, base.to_str(payload))
+                              for name, payload in payloads.items() if payload))
+        return generation
+
+    def get_archive(self):
+        return [(row[0], row[1]) for row in
+                self.get_conn().execute('SELECT generation, archived_at FROM archive ORDER BY generation DESC')]
+
+    def get_generation_collection(self, generation, start=0, stop=-1):
+        # Generation is resolved and items are read within one read transaction (so rotation cannot happen between)
+        conn = self.get_conn()
+        conn.execute('BEGIN')
+        try:
+            current = self.get_generation()
+            if generation == current:
+                name = base.RECENT_COLLECTION
+            elif generation == current - 1:
+                name = base.PREV_COLLECTION
+            elif conn.execute('SELECT 1 FROM archive WHERE generation = ?', (generation,)).fetchone() is not None:
+                name = ARCHIVE_COLLECTION_PREFIX + str(generation)
+            else:
+                return None
+            return self.get_collection(name, start, stop)
+        finally:
+            conn.execute('COMMIT')
+
+    def has_collection(self, name):
+        """Report if collection has any items
+
+        Returns:
+            bool
+        """
+        return self.get_conn().execute('SELECT 1 FROM items WHERE collection = ? LIMIT 1', (name,)).fetchone() \
+            is not None
+
+    def get_generation(self):
+        row = self.get_conn().execute('SELECT value FROM meta WHERE name = ?', (GENERATION_META,)).fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def get_payload(self, name):
+        # Payloads are replaced in the same transaction as generation, so they always belong to the current one
+        row = self.get_conn().execute('SELECT value FROM meta WHERE name = ?', (PAYLOAD_META_PREFIX + name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def acquire_token(self, bucket, rate, capacity):
+        # Bucket is read and updated under the write lock, so processes sharing the database file take turns
+        with self.transaction() as conn:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE name = ?', (bucket,)).fetchone()
+            tokens, wait = base.take_token(row[0] if row is not None else None, row[1] if row is not None else None,
+                                           now, rate, capacity)
+            conn.execute('INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)',
+                         (bucket, tokens, now))
+        return wait
+
+
+class Transaction(object):
+    """Context manager committing transaction on success and rolling it back on exception
+
+    Args:
+        conn (sqlite3.Connection): Connection with transaction begun
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
@@ -81,6 +81,26 @@ def get_section(section):
     return params
 
 
+def get_section_names(prefix=''):
+    """Get names of config sections, optionally only ones starting with given prefix
+
+    Args:
+        prefix (str='') Section name prefix
+
+    Returns:
+        list of str: Section names, in order of appearance
+
+    Raises:
+        Exception: Cannot get config sections
+    """
+    try:
+        sections = get_parser().sections()
+    except BaseException as ex:
+        raise Exception('Cannot get config sections: %s' % ex)
+
+    return [section for section in sections if section.startswith(prefix)]
+
+
 def save_param(section, param, value):
     """Set given param value and save results back to config file
 
@@ -145,6 +165,20 @@ save = set_param = save_param
 """Aliases for `save_param` method"""
 
 
+def parse_bool(value):
+    """Convert config value to bool
+
+    Args:
+        value (str or bool): Config value, e.g. 'true', 'yes', '1', 'off'
+
+    Returns:
+        bool
+    """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'yes', 'true', 'on')
+
+
 def get_parser():
     """Read and merge configuration files, then return parser instance
 
@@ -0,0 +1,244 @@
+"""Adaptive request scheduling driven by Twitter API rate limit headers"""
+import threading
+import time
+
+
+BACKOFF_DEFAULT = 60
+"""(int): Time to wait after "Too Many Requests" response not telling when the limit is reset, in seconds"""
+
+
+class RateScheduler(object):
+    """Spread remaining requests budget evenly over the rest of rate limit window
+
+    Budget is tracked from `x-rate-limit-remaining` and `x-rate-limit-reset` headers of API responses,
+    and is also decremented locally for each dispatched request (which response is not received yet)
+    Until the first response is received, requests are made at the default interval
+
+    Scheduler is thread-safe (shared by request dispatcher and fetching threads)
+
+    Attributes:
+        default_interval (float): Interval between requests while budget is unknown, in seconds
+        min_interval (float): Minimal interval between requests, in seconds
+    """
+    def __init__(self, default_interval, min_interval=0):
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self._remaining = None
+        self._reset = None
+        self._blocked_until = 0
+        self._last_request = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Register the request being dispatched"""
+        with self._lock:
+            self._last_request = time.time()
+            if self._remaining is not None and self._remaining > 0:
+                self._remaining -= 1
+
+    def get_delay(self):
+        """Get time left until the next request is due
+
+        Returns:
+            float: Delay in seconds (0 if request can be dispatched right now)
+        """
+        with self._lock:
+            return self._get_delay(time.time())
+
+    def get_interval(self):
+        """Get current interval between requests
+
+        Returns:
+            float: Interval in seconds
+        """
+        with self._lock:
+            return self._get_interval(time.time())
+
+    def update(self, remaining, reset):
+        """Update budget with rate limit headers values of the response received
+
+        Args:
+            remaining (str or int or None): `x-rate-limit-remaining` header value
+            reset (str or int or None): `x-rate-limit-reset` header value (UTC epoch seconds)
+
+        Raises:
+            ValueError: Wrong header value
+        """
+        if remaining is None or reset is None:
+            return
+
+        remaining = int(remaining)
+        reset = int(reset)
+
+        with self._lock:
+            # Responses to concurrent requests may come in any order:
+            # within the same window the lowest remaining value is the most recent one
+            if reset == self._reset and self._remaining is not None:
+                self._remaining = min(self._remaining, remaining)
+            elif self._reset is None or reset > self._reset:
+                self._remaining = remaining
+                self._reset = reset
+
+    def backoff(self, reset=None):
+        """Suspend requests after "Too Many Requests" response
+
+        Args:
+            reset (str or int=None): UTC epoch seconds when rate limit is reset (`x-rate-limit-reset` header value),
+                                     if not given, requests are suspended for `BACKOFF_DEFAULT` seconds
+        """
+        now = time.time()
+        try:
+            blocked_until = int(reset)
+        except (TypeError, ValueError):
+            blocked_until = 0
+        if blocked_until <= now:
+            blocked_until = now + BACKOFF_DEFAULT
+
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, blocked_until)
+            self._remaining = 0
+            self._reset = int(blocked_until)
+
+    def get_status(self):
+        """Get current scheduler state
+
+        Returns:
+            dict: {
+                'interval': 2.0,      # Current interval between requests, in seconds
+                'delay': 0.5,         # Time left until the next request is due, in seconds
+                'rate': 30.0,         # Current rate, in requests per minute
+                'remaining': 120,     # Remaining requests budget (None if unknown yet)
+                'reset': 1454885884,  # UTC epoch seconds when rate limit window is reset (None if unknown yet)
+                'blocked': False,     # Whether requests are suspended after "Too Many Requests" response
+            }
+        """
+        with self._lock:
+            now = time.time()
+            interval = self._get_interval(now)
+            return {
+                'interval': interval,
+                'delay': self._get_delay(now),
+                'rate': 60.0 / interval if interval > 0 else None,
+                'remaining': self._remaining,
+                'reset': self._reset,
+                'blocked': self._blocked_until > now,
+            }
+
+    def _get_delay(self, now):
+        """Calculate time left until the next request is due (must be called with the lock acquired)
+
+        Args:
+            now (float): Current UTC epoch time
+
+        Returns:
+            float: Delay in seconds
+        """
+        if self._blocked_until > now:
+            return self._blocked_until - now
+        if self._remaining is not None and self._remaining <= 0 and self._reset is not None and self._reset > now:
+            return self._reset - now
+        return max(self._last_request + self._get_interval(now) - now, 0)
+
+    def _get_interval(self, now):
+        """Calculate interval between requests (must be called with the lock acquired)
+
+        Args:
+            now (float): Current UTC epoch time
+
+        Returns:
+            float: Interval in seconds
+        """
+        # Wait until backoff is over
+        if self._blocked_until > now:
+            return self._blocked_until - now
+
+        # Budget is unknown, or the window is already over
+        if self._remaining is None or self._reset is None or self._reset <= now:
+            return self.default_interval
+
+        # Budget is exhausted: wait for the next window
+        if self._remaining <= 0:
+            return self._reset - now
+
+        # Spread remaining requests over the rest of the window
+        return max((self._reset - now) / float(self._remaining), self.min_interval)
+
+
+class SchedulerPool(object):
+    """Rotate requests across several credential sets, each having its own rate limit budget
+
+    Request is dispatched as soon as any credential set is due, using the one having the largest remaining budget
+    (credential sets with unknown budget are used first), so aggregate rate grows with credential sets count
+    Requests are also spaced by aggregate interval, so that credential sets are not used in simultaneous bursts
+
+    Attributes:
+        names (list of str): Credential set names
+        schedulers (dict of str: RateScheduler): Schedulers by credential set name
+    """
+    def __init__(self, names, default_interval, min_interval=0):
+        self.names = list(names)
+        self.schedulers = dict((name, RateScheduler(default_interval, min_interval)) for name in self.names)
+        self._last_request = 0
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Get scheduler of given credential set
+
+        Args:
+            name (str): Credential set name
+
+        Returns:
+            RateScheduler
+        """
+        return self.schedulers[name]
+
+    def get_delay(self):
+        """Get time left until the next request is due with any credential set
+
+        Returns:
+            float: Delay in seconds (0 if request can be dispatched right now)
+        """
+        delay = min(self.schedulers[name].get_delay() for name in self.names)
+        return max(delay, self._last_request + self.get_interval() - time.time())
+
+    def get_interval(self):
+        """Get current aggregate interval between requests
+
+        Returns:
+            float: Interval in seconds
+        """
+        rate = sum(1.0 / interval for interval in
+                   (self.schedulers[name].get_interval() for name in self.names) if interval > 0)
+        return 1.0 / rate if rate > 0 else 0
+
+    def acquire(self):
+        """Choose credential set for the request being dispatched, and register the request with its scheduler
+
+        Returns:
+            str or None: Credential set name (None if no credential set is due yet)
+        """
+        with self._lock:
+            best_name = None
+            best_remaining = None
+            for name in self.names:
+                status = self.schedulers[name].get_status()
+                if status['delay'] > 0:
+                    continue
+                remaining = status['remaining'] if status['remaining'] is not None else float('inf')
+                if best_name is None or remaining > best_remaining:
+                    best_name = name
+                    best_remaining = remaining
+
+            if best_name is not None:
+                self.schedulers[best_name].acquire()
+                self._last_request = time.time()
+
+            return best_name
+
+    def get_status(self):
+        """Get current state of all schedulers
+
+        Returns:
+            dict of (str: dict): Scheduler status by credential set name (see `RateScheduler.get_status()`)
+        """
+        return dict((name, self.schedulers[name].get_status()) for name in self.names)
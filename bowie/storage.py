@@ -1,58 +1,119 @@
-"""Storage routines"""
+"""Storage routines
+Data is kept by the storage backend selected in config (see `get_backend()` and `bowie.backends`)
+"""
 from bowie import config
-import redis
+from bowie import backends
+from bowie import txtools
+from bowie.backends import base
+import os
+import json
+import threading
+import time
 
-WORDS_LIST_KEY = 'words'
-PREV_COLLECTION_LIST_KEY = 'prev'
-RECENT_COLLECTION_LIST_KEY = 'recent'
-UPCOMING_COLLECTION_LIST_KEY = 'upcoming'
+PREV_COLLECTION = base.PREV_COLLECTION
+RECENT_COLLECTION = base.RECENT_COLLECTION
+UPCOMING_COLLECTION = base.UPCOMING_COLLECTION
 
+ARCHIVE_SIZE_DEFAULT = 10
+"""(int): Default number of archived collections kept (`archive_size` param of `storage` config section)"""
 
-def get_conn():
-    """Establish connection and return redis instance"""
-    # Get redis config
-    try:
-        cfg = config.get('redis')
-    except BaseException as ex:
-        raise Exception('Cannot get redis configuration: %s' % ex)
+ARCHIVE_MAX_AGE_DEFAULT = 0
+"""(int): Default maximum age of archived collection in seconds, 0 means no age limit
+   (`archive_max_age` param of `storage` config section)
+"""
 
-    # Establish connection
-    try:
-        rds = redis.StrictRedis(**cfg)
-    except BaseException as ex:
-        raise Exception('Cannot establish redis connection: %s' % ex)
+IMPORT_CHUNK_SIZE = 10000
+"""(int): Number of words normalized and written per staging write by `import_words()`"""
+
+_backend = None
+"""(bowie.backends.base.Backend): Process-wide backend instance, see `get_backend()`"""
+
+_backend_pid = None
+"""(int): ID of the process which created `_backend`"""
+
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Get process-wide storage backend instance, creating it on first call or after fork
+    Backend name is read from `backend` param of `storage` config section ('redis' by default),
+    backend options are read from the config section having the backend's name (e.g. `redis` or `sqlite`)
+
+    Backend instance is shared between all threads of the process (Flask views, collector fetchers and saver)
+
+    Returns:
+        bowie.backends.base.Backend
+
+    Raises:
+        Exception: Cannot create storage backend
+    """
+    global _backend, _backend_pid
+
+    pid = os.getpid()
+    if _backend is not None and _backend_pid == pid:
+        return _backend
+
+    with _backend_lock:
+        # Other thread may have created the backend while we were waiting for the lock
+        if _backend is not None and _backend_pid == pid:
+            return _backend
 
-    # Return redis instance
-    return rds
+        # Get backend name and options
+        name = get_option('backend', backends.DEFAULT_BACKEND)
+        try:
+            options = config.get(name)
+        except ValueError:
+            options = {}
 
+        # Create the backend
+        try:
+            _backend = backends.create(name, options)
+        except BaseException as ex:
+            raise Exception('Cannot create `%s` storage backend: %s' % (name, ex))
+        _backend_pid = pid
 
-def get_members(key):
-    """Wrapper method for getting all members of specified list
+    return _backend
+
+
+def set_backend(backend):
+    """Use given backend instance in the current process instead of configured one (e.g. for benchmarks)
 
     Args:
-        key (str) Name of redis list
+        backend (bowie.backends.base.Backend)
     """
-    # Connect to redis
-    try:
-        rds = get_conn()
-    except BaseException as ex:
-        raise Exception('Cannot connect to redis: %s' % ex)
+    global _backend, _backend_pid
 
-    # Get members of the list
+    with _backend_lock:
+        _backend = backend
+        _backend_pid = os.getpid()
+
+
+def get_option(param, default):
+    """Get param value from `storage` config section
+
+    Args:
+        param (str) Parameter name
+        default (str or int) Value returned if parameter (or the whole section) is not configured
+
+    Returns:
+        str or int
+    """
     try:
-        members = rds.lrange(key, 0, -1)
-    except BaseException as ex:
-        raise Exception('Cannot get `%s` list from redis: %s' % (key, ex))
+        return config.get('storage', param)
+    except ValueError:
+        return default
 
-    # Return obtained words
-    return members
 
+def get_words(start=0, stop=-1):
+    """Get words list from storage
 
-def get_words():
-    """Get words list from storage"""
+    Args:
+        start (int=0) Index of the first item to get
+        stop (int=-1) Index of the last item to get, inclusive (-1 means the end of the list)
+    """
     # Get words list
     try:
-        words = get_members(WORDS_LIST_KEY)
+        words = get_backend().get_words(start, stop)
     except BaseException as ex:
         raise Exception('Cannot get words list: %s' % ex)
 
@@ -60,23 +121,33 @@ def get_words():
     return words
 
 
-def get_prev_collection():
-    """Get previous collection list from storage"""
+def get_prev_collection(start=0, stop=-1):
+    """Get previous collection list from storage
+
+    Args:
+        start (int=0) Index of the first item to get
+        stop (int=-1) Index of the last item to get, inclusive (-1 means the end of the list)
+    """
     # Get collection items
     try:
-        collection = get_members(PREV_COLLECTION_LIST_KEY)
+        collection = get_backend().get_collection(PREV_COLLECTION, start, stop)
     except BaseException as ex:
         raise Exception('Cannot get previous collection: %s' % ex)
 
-        # Return obtained collection items
+    # Return obtained collection items
     return collection
 
 
-def get_recent_collection():
-    """Get recent collection list from storage"""
+def get_recent_collection(start=0, stop=-1):
+    """Get recent collection list from storage
+
+    Args:
+        start (int=0) Index of the first item to get
+        stop (int=-1) Index of the last item to get, inclusive (-1 means the end of the list)
+    """
     # Get collection items
     try:
-        collection = get_members(RECENT_COLLECTION_LIST_KEY)
+        collection = get_backend().get_collection(RECENT_COLLECTION, start, stop)
     except BaseException as ex:
         raise Exception('Cannot get recent collection: %s' % ex)
 
@@ -84,81 +155,300 @@ def get_recent_collection():
     return collection
 
 
+def get_upcoming_collection(start=0, stop=-1):
+    """Get upcoming collection list from storage
+
+    Args:
+        start (int=0) Index of the first item to get
+        stop (int=-1) Index of the last item to get, inclusive (-1 means the end of the list)
+    """
+    # Get collection items
+    try:
+        collection = get_backend().get_collection(UPCOMING_COLLECTION, start, stop)
+    except BaseException as ex:
+        raise Exception('Cannot get upcoming collection: %s' % ex)
+
+    # Return obtained collection items
+    return collection
+
+
+def get_payload(name):
+    """Get pre-rendered API payload stored for current collection generation
+
+    Args:
+        name (str) Payload name, e.g. 'collections' or 'stat'
+
+    Returns:
+        str or None: Payload body (None if not stored for current generation)
+    """
+    try:
+        payload = get_backend().get_payload(name)
+    except BaseException as ex:
+        raise Exception('Cannot get `%s` payload: %s' % (name, ex))
+
+    return payload
+
+
 def set_words(words):
-    """Store given words to redis, replacing previous list
+    """Store given words, replacing previous list
+    Also store normalized words list (see `txtools.normalize()`)
 
     Args:
         words (list of string) or (list of unicode)
     """
-    # Connect to redis
+    # Normalize words
+    try:
+        normalized = txtools.normalize_many(words)
+    except BaseException as ex:
+        raise Exception('Cannot normalize words list: %s' % ex)
+
+    # Store everything
+    try:
+        get_backend().set_words(words, normalized)
+    except BaseException as ex:
+        raise Exception('Cannot write new words list: %s' % ex)
+
+
+def import_words(words, confirm=None, progress=None):
+    """Store words read from given iterable, replacing previous list once all of them are written
+    Words are normalized and written to staging list in chunks of `IMPORT_CHUNK_SIZE`, so a text of any length can be
+    imported without keeping it in memory, and previous words list is used until the new one is complete
+    Upcoming collection is cleared along with collection process checkpoint once words list is replaced
+
+    Args:
+        words (iterable of str or unicode): Words to store
+        confirm (callable=None): Called with number of words written before replacing previous list,
+                                 which is kept (and written words are discarded) unless it returns True
+                                 (written words are also discarded if an exception is raised, e.g. KeyboardInterrupt)
+        progress (callable=None): Called with number of words written so far, after each chunk
+
+    Returns:
+        int or None: Number of words stored (None if not confirmed)
+    """
+    count = 0
+
+    def write_chunk(chunk):
+        try:
+            normalized = txtools.normalize_many(chunk)
+        except BaseException as ex:
+            raise Exception('Cannot normalize words list: %s' % ex)
+
+        try:
+            get_backend().stage_words(chunk, normalized)
+        except BaseException as ex:
+            raise Exception('Cannot write staging words list: %s' % ex)
+
+    # Write words to staging list
+    try:
+        get_backend().discard_staged_words()
+    except BaseException as ex:
+        raise Exception('Cannot clear staging words list: %s' % ex)
+
+    # Staged words are discarded unless they replace words list (e.g. when not confirmed, or import is interrupted)
+    committed = False
+    try:
+        chunk = []
+        for word in words:
+            chunk.append(word)
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                write_chunk(chunk)
+                count += len(chunk)
+                chunk = []
+                if progress is not None:
+                    progress(count)
+        if len(chunk) > 0:
+            write_chunk(chunk)
+            count += len(chunk)
+            if progress is not None:
+                progress(count)
+
+        # Replace words list with staging one, if confirmed
+        if confirm is not None and not confirm(count):
+            return None
+
+        try:
+            get_backend().commit_staged_words()
+        except BaseException as ex:
+            raise Exception('Cannot replace words list with staging one: %s' % ex)
+        committed = True
+    finally:
+        if not committed:
+            try:
+                get_backend().discard_staged_words()
+            except Exception:
+                pass
+
+    # Upcoming collection and its checkpoint were made for previous words list
+    clear_upcoming_collection()
+
+    return count
+
+
+def get_normalized_words(start=0, stop=-1):
+    """Get normalized words list from storage (aligned with words list)
+
+    Args:
+        start (int=0) Index of the first item to get
+        stop (int=-1) Index of the last item to get, inclusive (-1 means the end of the list)
+
+    Returns:
+        list of unicode
+    """
     try:
-        rds = get_conn()
+        words = get_backend().get_normalized_words(start, stop)
     except BaseException as ex:
-        raise Exception('Cannot connect to redis: %s' % ex)
+        raise Exception('Cannot get normalized words list: %s' % ex)
+
+    return [word.decode('utf8') for word in words]
+
+
+def shift_collections(payloads=None):
+    """Replace "recent" collection with "upcoming" one, and "prev" collection with former "recent" one
+    Rotation is done atomically, collection generation counter is incremented,
+    and given payloads are stored for the new generation
+    Former "prev" collection is moved to archive, which is trimmed to configured size and age
+
+    Args:
+        payloads (dict of str: str=None) Pre-rendered API payloads for the new generation, by name
+
+    Returns:
+        int: New collection generation
 
-    # Remove previous list members
+    Raises:
+        Exception: Wrong archive configuration
+        Exception: Cannot shift collections
+    """
+    # Get archive retention params
     try:
-        rds.delete(WORDS_LIST_KEY)
+        archive_size = int(get_option('archive_size', ARCHIVE_SIZE_DEFAULT))
+        archive_max_age = int(get_option('archive_max_age', ARCHIVE_MAX_AGE_DEFAULT))
     except BaseException as ex:
-        raise Exception('Cannot clear previous words list in redis: %s' % ex)
+        raise Exception('Wrong archive configuration: %s' % ex)
 
-    # Write new words list to redis
+    # Rotate collections
     try:
-        rds.rpush(WORDS_LIST_KEY, *words)
+        generation = get_backend().shift_collections(payloads or {}, archive_size, archive_max_age)
     except BaseException as ex:
-        raise Exception('Cannot write new words list to redis: %s' % ex)
+        raise Exception('Cannot shift collections: %s' % ex)
+
+    return generation
 
 
-def shift_collections():
-    """Replace "recent" collection with "upcoming" one, and "prev" collection with former "recent" one"""
-    # Connect to redis
+def get_archive():
+    """Get archived collections list, newest first
+
+    Returns:
+        list of tuple: [(generation, archived_at), ...], e.g. [(12, 1454885884), (11, 1454799484)]
+    """
     try:
-        rds = get_conn()
+        archive = get_backend().get_archive()
     except BaseException as ex:
-        raise Exception('Cannot connect to redis: %s' % ex)
+        raise Exception('Cannot get collections archive: %s' % ex)
+
+    return archive
+
+
+def get_generation_collection(generation, start=0, stop=-1):
+    """Get collection by its generation (recent, previous or archived one)
 
-    # Overwrite "prev" collection with f"recent" one
+    Args:
+        generation (int) Collection generation
+        start (int=0) Index of the first item to get
+        stop (int=-1) Index of the last item to get, inclusive (-1 means the end of the list)
+
+    Returns:
+        list of str or None: Collection items (None if there is no collection of given generation)
+    """
     try:
-        rds.rename(RECENT_COLLECTION_LIST_KEY, PREV_COLLECTION_LIST_KEY)
-    except:
-        pass  # That's not an error, because on the first step "recent" collection may not exist
+        collection = get_backend().get_generation_collection(generation, start, stop)
+    except BaseException as ex:
+        raise Exception('Cannot get collection of generation %d: %s' % (generation, ex))
+
+    return collection
+
+
+def get_generation():
+    """Get current collection generation (incremented by each `shift_collections()` call)
 
-    # Overwrite "recent" collection with "upcoming" one
+    Returns:
+        int: Generation number (0 if collections were never shifted)
+    """
     try:
-        rds.rename(UPCOMING_COLLECTION_LIST_KEY, RECENT_COLLECTION_LIST_KEY)
+        generation = get_backend().get_generation()
     except BaseException as ex:
-        raise Exception('Cannot overwrite recent collection: %s' % ex)
+        raise Exception('Cannot get collection generation: %s' % ex)
+
+    return generation
+
+
+def acquire_token(bucket, rate, capacity):
+    """Take a token from rate limiting bucket shared by all processes using the storage, waiting for it if needed
+
+    Args:
+        bucket (str) Bucket name
+        rate (float) Tokens added to the bucket per second
+        capacity (int) Maximum number of tokens in the bucket
+
+    Returns:
+        float: Seconds waited for the token
+    """
+    waited = 0
+    while True:
+        try:
+            wait = get_backend().acquire_token(bucket, rate, capacity)
+        except BaseException as ex:
+            raise Exception('Cannot acquire `%s` bucket token: %s' % (bucket, ex))
+
+        if wait <= 0:
+            return waited
+        time.sleep(wait)
+        waited += wait
 
 
 def append_upcoming_item(item):
     """Add new item to upcoming collection
 
     Args:
-        item (str) Stringified JSON data representing tweet
+        item (str) Encoded tweet record (see `twitter.encode_record()`)
     """
-    # Connect to redis
-    try:
-        rds = get_conn()
-    except BaseException as ex:
-        raise Exception('Cannot connect to redis: %s' % ex)
+    append_upcoming_items([item])
+
+
+def append_upcoming_items(items, checkpoint=None):
+    """Add new items to upcoming collection, keeping their order, with a single write
+    The batch is saved either completely or not at all (and can be safely retried),
+    together with collection process checkpoint if given
+
+    Args:
+        items (list of str) Encoded tweet records (see `twitter.encode_record()`)
+        checkpoint (dict=None) JSON-serializable collection process state after the last of given items
+    """
+    if len(items) < 1:
+        return
 
-    # Write item to redis
     try:
-        rds.rpush(UPCOMING_COLLECTION_LIST_KEY, item)
+        get_backend().append_upcoming_items(items, json.dumps(checkpoint) if checkpoint is not None else None)
     except BaseException as ex:
-        raise Exception('Cannot write new upcoming item to redis: %s' % ex)
+        raise Exception('Cannot write new upcoming items: %s' % ex)
 
 
-def clear_upcoming_collection():
-    """Remove all members from upcoming collection"""
-    # Connect to redis
+def get_checkpoint():
+    """Get collection process checkpoint saved with the last upcoming items
+
+    Returns:
+        dict or None: Collection process state (None if there is no process to resume)
+    """
     try:
-        rds = get_conn()
+        checkpoint = get_backend().get_checkpoint()
     except BaseException as ex:
-        raise Exception('Cannot connect to redis: %s' % ex)
+        raise Exception('Cannot get checkpoint: %s' % ex)
 
-    # Clear upcoming collection list
+    return json.loads(checkpoint) if checkpoint is not None else None
+
+
+def clear_upcoming_collection():
+    """Remove all members from upcoming collection (and collection process checkpoint)"""
     try:
-        rds.delete(UPCOMING_COLLECTION_LIST_KEY)
+        get_backend().clear_upcoming_collection()
     except BaseException as ex:
-        raise Exception('Cannot clear upcoming collection in redis: %s' % ex)
+        raise Exception('Cannot clear upcoming collection: %s' % ex)
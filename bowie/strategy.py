@@ -0,0 +1,186 @@
+"""Search strategy selection driven by words collected per request (yield) of each query mode"""
+from collections import deque
+import threading
+import time
+
+
+MODES = ['hashtag', 'plain', 'narrow', 'focus']
+"""(list of str): Query mode names, in order they are tried on the first requests
+   `hashtag`: query words packed as query limits allow, each required to come with priority hashtag
+   `plain`: query words packed as query limits allow
+   `narrow`: up to 5 query words
+   `focus`: only the first uncollected word
+"""
+
+MODE_PARAMS = {
+    'hashtag': {'hashtag': True, 'width': None},
+    'plain': {'hashtag': False, 'width': None},
+    'narrow': {'hashtag': False, 'width': 5},
+    'focus': {'hashtag': False, 'width': 1},
+}
+"""(dict of str: dict): Query params of each mode: whether priority hashtag is required,
+   and maximum number of unique words in query (None means as many as query limits allow)
+"""
+
+TIE_ORDER = ['focus', 'plain', 'narrow', 'hashtag']
+"""(list of str): Mode names in order of preference on equal yields, the broadest search first
+   (e.g. when every recent yield is 0, the collector is stuck on a rare word, which only `focus` may find)
+"""
+
+VAIN_REQUESTS_UNTIL_FOCUS = 5
+"""(int): Number of consecutive requests without collected words after which `focus` mode is used
+   until a word is collected again
+"""
+
+YIELD_WINDOW = 10
+"""(int): Number of recent requests of each mode taken into account for its yield"""
+
+EXPLORE_EVERY = 10
+"""(int): Each n-th request uses the mode tried least recently, so yields of other modes are kept up to date"""
+
+REASONS = ['untried', 'exploit', 'explore', 'vain']
+"""(list of str): Reasons the mode is chosen for
+   `untried`: the mode was not tried yet
+   `exploit`: the mode has the best recent yield
+   `explore`: each `EXPLORE_EVERY`-th request tries the mode tried least recently
+   `vain`: `focus` mode after `VAIN_REQUESTS_UNTIL_FOCUS` consecutive requests without collected words
+"""
+
+LOG_SIZE = 1000
+"""(int): Number of recent decisions kept in the log"""
+
+
+class StrategySelector(object):
+    """Choose query mode having the best recent yield (average number of words collected per request)
+
+    Modes never tried yet are chosen first, then the best one, except each `EXPLORE_EVERY`-th request using the mode
+    tried least recently (yield of a mode depends on words being searched, so it changes along the text)
+    After `VAIN_REQUESTS_UNTIL_FOCUS` consecutive requests without collected words, `focus` mode is used
+
+    Selector is thread-safe (requests of different modes may be in flight simultaneously)
+
+    Attributes:
+        log (collections.deque): Recent decisions and their results:
+                                 [(time, mode, reason, mode's yield before the request, collected words count), ...]
+    """
+    def __init__(self):
+        self.log = deque(maxlen=LOG_SIZE)
+        self._yields = dict((mode, deque(maxlen=YIELD_WINDOW)) for mode in MODES)
+        self._totals = dict((mode, {'requests': 0, 'words': 0}) for mode in MODES)
+        self._last_chosen = dict((mode, 0) for mode in MODES)
+        self._choices = 0
+        self._vain = 0
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Choose mode for the next request
+
+        Returns:
+            str: Mode name (see `MODES` and `get_params()`)
+            str: Reason the mode is chosen for (see `REASONS`)
+        """
+        with self._lock:
+            self._choices += 1
+            untried = [mode for mode in MODES if self._totals[mode]['requests'] < 1
+                       and self._last_chosen[mode] == 0]
+            if self._vain >= VAIN_REQUESTS_UNTIL_FOCUS:
+                mode, reason = 'focus', 'vain'
+            elif len(untried) > 0:
+                mode, reason = untried[0], 'untried'
+            elif self._choices % EXPLORE_EVERY == 0:
+                mode, reason = min(MODES, key=lambda name: self._last_chosen[name]), 'explore'
+            else:
+                mode, reason = max(MODES, key=lambda name: (self._get_yield(name), -TIE_ORDER.index(name))), 'exploit'
+
+            self._last_chosen[mode] = self._choices
+            return mode, reason
+
+    def record(self, mode, reason, collected):
+        """Record number of words collected with the request of given mode
+
+        Args:
+            mode (str): Mode name
+            reason (str): Reason the mode was chosen for (see `choose()`)
+            collected (int): Collected words count
+        """
+        with self._lock:
+            self.log.append((time.time(), mode, reason, self._get_yield(mode), collected))
+            self._yields[mode].append(collected)
+            self._totals[mode]['requests'] += 1
+            self._totals[mode]['words'] += collected
+            self._vain = self._vain + 1 if collected < 1 else 0
+
+    def get_stats(self):
+        """Get yields of all modes
+
+        Returns:
+            dict of (str: dict): {'plain': {'requests': 12, 'words': 30, 'yield': 2.5}, ...}
+                                 (`yield` is average over recent requests, None if the mode was not used yet)
+        """
+        with self._lock:
+            return dict((mode, dict(self._totals[mode], **{'yield': self._get_yield(mode)})) for mode in MODES)
+
+    def get_decisions(self):
+        """Summarize recent decisions (see `log`) by reason
+
+        Returns:
+            dict of (str: dict): {'exploit': {'requests': 12, 'words': 30}, ...}
+        """
+        with self._lock:
+            decisions = dict((reason, {'requests': 0, 'words': 0}) for reason in REASONS)
+            for _, _, reason, _, collected in self.log:
+                decisions[reason]['requests'] += 1
+                decisions[reason]['words'] += collected
+            return decisions
+
+    def get_state(self):
+        """Get JSON-serializable selector state (see `set_state()`)
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            return {
+                'yields': dict((mode, list(self._yields[mode])) for mode in MODES),
+                'totals': dict((mode, dict(self._totals[mode])) for mode in MODES),
+                'vain': self._vain,
+            }
+
+    def set_state(self, state):
+        """Restore selector state (e.g. when resuming interrupted process)
+
+        Args:
+            state (dict): Selector state (see `get_state()`)
+        """
+        with self._lock:
+            for mode in MODES:
+                self._yields[mode].clear()
+                self._yields[mode].extend(state['yields'].get(mode, []))
+                self._totals[mode].update(state['totals'].get(mode, {}))
+            self._vain = state.get('vain', 0)
+
+    def _get_yield(self, mode):
+        """Calculate recent yield of the mode (must be called with the lock acquired)
+
+        Args:
+            mode (str): Mode name
+
+        Returns:
+            float or None: Average collected words count per request (None if the mode was not used yet)
+        """
+        yields = self._yields[mode]
+        if len(yields) < 1:
+            return None
+        return float(sum(yields)) / len(yields)
+
+
+def get_params(mode):
+    """Get query params of given mode (see `MODE_PARAMS`)
+
+    Args:
+        mode (str): Mode name
+
+    Returns:
+        dict: {'hashtag': True, 'width': None}
+    """
+    return MODE_PARAMS[mode]
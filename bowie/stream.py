@@ -0,0 +1,209 @@
+"""Tweet stream transports for streaming collection mode (see `twitter.assemble_collection()`)
+Stream is newline-delimited JSON (one tweet per line, as Twitter streaming API sends them), read from a file
+or a TCP socket; `serve()` replays NDJSON file over TCP, standing in for the real streaming API
+"""
+from bowie import config
+import json
+import socket
+import SocketServer
+import time
+import urlparse
+
+
+REPLAY_INTERVAL_DEFAULT = 0
+"""(float): Default delay between replayed tweets, in seconds"""
+
+SOCKET_TIMEOUT_DEFAULT = 90
+"""(float): Default socket read timeout, in seconds (streaming API sends keep-alive newlines every 30 seconds)"""
+
+
+class Transport(object):
+    """Base class for stream transports: iterating over transport yields tweets data as they arrive
+
+    Args:
+        options (dict of str: str): Transport options (from stream URL query string)
+    """
+    def __init__(self, options):
+        self.options = options
+
+    def __iter__(self):
+        for line in self.read_lines():
+            post = parse_line(line)
+            if post is not None:
+                yield post
+
+    def read_lines(self):
+        """Read stream lines
+
+        Returns:
+            iterable of str
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release transport resources"""
+        pass
+
+
+class FileTransport(Transport):
+    """Replay tweets from NDJSON file
+
+    Options:
+        interval (float=0): Delay between tweets, in seconds
+        retime (bool=true): Set tweets time to the moment they are replayed
+                            (recorded tweets are older than collection process begin otherwise)
+    """
+    def __init__(self, options, path):
+        super(FileTransport, self).__init__(options)
+        self.path = path
+        self.interval = float(options.get('interval', REPLAY_INTERVAL_DEFAULT))
+        self.retime = config.parse_bool(options.get('retime', True))
+
+    def __iter__(self):
+        return replay(super(FileTransport, self).__iter__(), self.interval, self.retime)
+
+    def read_lines(self):
+        with open(self.path, 'rb') as fd:
+            for line in fd:
+                yield line
+
+
+class SocketTransport(Transport):
+    """Read tweets from NDJSON sent over TCP connection (e.g. by `serve()`)
+
+    Options:
+        timeout (float=90): Socket read timeout, in seconds
+    """
+    def __init__(self, options, host, port):
+        super(SocketTransport, self).__init__(options)
+        self.address = (host, port)
+        self._socket = None
+
+    def read_lines(self):
+        timeout = float(self.options.get('timeout', SOCKET_TIMEOUT_DEFAULT))
+        self._socket = socket.create_connection(self.address, timeout)
+        fd = self._socket.makefile('rb')
+        try:
+            for line in iter(fd.readline, ''):
+                yield line
+        finally:
+            fd.close()
+            self.close()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+TRANSPORTS = ('file', 'tcp')
+"""(tuple of str): Supported stream URL schemes"""
+
+
+def open_stream(url):
+    """Create stream transport for given URL
+
+    Args:
+        url (str): Stream URL, e.g. 'file:///path/to/tweets.ndjson?interval=0.5' or 'tcp://127.0.0.1:9999'
+                   (a path without scheme means a file)
+
+    Returns:
+        Transport
+
+    Raises:
+        ValueError: Unknown stream transport
+        ValueError: Wrong stream URL
+    """
+    parsed = urlparse.urlsplit(url)
+    options = dict(urlparse.parse_qsl(parsed.query))
+    scheme = parsed.scheme or 'file'
+
+    if scheme not in TRANSPORTS:
+        raise ValueError('Unknown stream transport: "%s" (supported: %s)' % (scheme, ', '.join(TRANSPORTS)))
+
+    if scheme == 'file':
+        if not parsed.path:
+            raise ValueError('Wrong stream URL, file path is missing: "%s"' % url)
+        return FileTransport(options, parsed.netloc + parsed.path)
+
+    if not parsed.hostname or not parsed.port:
+        raise ValueError('Wrong stream URL, host and port are required: "%s"' % url)
+    return SocketTransport(options, parsed.hostname, parsed.port)
+
+
+def parse_line(line):
+    """Decode tweet data from stream line
+
+    Args:
+        line (str): JSON line
+
+    Returns:
+        dict or None: Tweet data (None for keep-alive newlines and non-tweet messages, e.g. deletion notices)
+
+    Raises:
+        ValueError: Wrong stream line
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    try:
+        data = json.loads(line)
+    except ValueError as ex:
+        raise ValueError('Wrong stream line: %s' % ex)
+
+    if not isinstance(data, dict) or 'text' not in data or 'id' not in data:
+        return None
+    return data
+
+
+def replay(posts, interval=REPLAY_INTERVAL_DEFAULT, retime=True):
+    """Yield tweets with given delay between them
+
+    Args:
+        posts (iterable of dict): Tweets data
+        interval (float=0): Delay between tweets, in seconds
+        retime (bool=True): Set `created_at` of each tweet to the moment it is yielded (but not earlier than a second
+                            after replay begin, as collection process begin time has one second precision)
+
+    Returns:
+        iterable of dict
+    """
+    time_begin = time.time()
+    for i, post in enumerate(posts):
+        if i > 0 and interval > 0:
+            time.sleep(interval)
+        if retime:
+            post['created_at'] = time.strftime('%a %b %d %H:%M:%S +0000 %Y',
+                                               time.gmtime(max(time.time(), time_begin + 1)))
+        yield post
+
+
+def serve(path, host='127.0.0.1', port=9999, interval=REPLAY_INTERVAL_DEFAULT, retime=True):
+    """Replay NDJSON file to each client connected over TCP, until interrupted
+
+    Args:
+        path (str): NDJSON file path
+        host (str='127.0.0.1'): Address to listen at
+        port (int=9999): Port to listen at
+        interval (float=0): Delay between tweets, in seconds
+        retime (bool=True): Set `created_at` of each tweet to the moment it is sent
+    """
+    class ReplayHandler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            try:
+                for post in FileTransport({'interval': interval, 'retime': retime}, path):
+                    self.wfile.write(json.dumps(post) + '\r\n')
+                    self.wfile.flush()
+            except socket.error:
+                pass
+
+    class ReplayServer(SocketServer.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    server = ReplayServer((host, port), ReplayHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
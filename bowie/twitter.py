@@ -1,26 +1,93 @@
 """Fetch, process and store tweets data"""
 from bowie import config
+from bowie import ratelimit
 from bowie import storage
+from bowie import strategy
 from bowie import txtools
-from twython import Twython
-import re
+from twython import Twython, TwythonRateLimitError
+from requests.adapters import HTTPAdapter
+import os
+import bisect
+import hashlib
 import json
 import threading
-from Queue import Queue
+from Queue import Queue, Empty
 import time
+import calendar
+from collections import OrderedDict
 
 
 PRIORITY_HASHTAG = '#singwithbowie'
 REQUEST_INTERVAL = 15 * 60 / 450
-WORDS_PER_REQUEST = 3
-VAIN_REQUESTS_UNTIL_FOCUS = 5
-VAIN_HASHTAG_REQUESTS_MAX = 1
+QUERY_LENGTH_MAX = 500
+QUERY_OPERATORS_MAX = 20
 ITEMS_PER_REQUEST = 100
+FETCH_WORKERS = 3
+LOOKAHEAD_CACHE_SIZE = 1000
+SCHEDULE_CHECK_INTERVAL = 0.5
+SAVER_BATCH_WINDOW = 0.5
+SAVER_RETRY_INTERVAL = 1
+STAT_SLOWEST_DEFAULT = 5
+RECORD_VERSION = 1
+API_TIMEOUT_DEFAULT = 10
+RATE_LIMIT_DEFAULT = 450
+RATE_LIMIT_WINDOW = 15 * 60
+BUCKET_CAPACITY_DEFAULT = 5
 
+CREDENTIALS_SECTION = 'twitter'
+"""str: Config section of the main credential set
+Additional credential sets are kept in sections named with colon-separated suffix, e.g. `twitter:backup`
+"""
 
-def get_token():
+_apis = {}
+"""(dict of str: twython.Twython): Process-wide Twitter API instances by credential set name, see `get_api()`"""
+
+_apis_pid = None
+"""(int): ID of the process which created `_apis`"""
+
+_api_lock = threading.Lock()
+
+
+class TweetDataError(Exception):
+    """Stored tweet data cannot be processed
+
+    Attributes:
+        code (int): Error code for more convenient debugging (passed to API error output)
+    """
+    def __init__(self, message, code):
+        super(TweetDataError, self).__init__(message)
+        self.code = code
+
+
+def get_credential_names():
+    """Get names of all configured Twitter credential sets (config section names)
+
+    Returns:
+        list of str: ['twitter', 'twitter:backup', ...]
+
+    Raises:
+        Exception: Cannot get twitter configuration
+        ValueError: No twitter credentials configured
+    """
+    try:
+        sections = config.get_section_names(CREDENTIALS_SECTION)
+    except Exception as ex:
+        raise Exception('Cannot get twitter configuration: %s' % ex)
+
+    names = [section for section in sections
+             if section == CREDENTIALS_SECTION or section.startswith(CREDENTIALS_SECTION + ':')]
+    if len(names) < 1:
+        raise ValueError('No twitter credentials configured')
+
+    return names
+
+
+def get_token(name=CREDENTIALS_SECTION):
     """Get access token for Twitter OAuth 2.0
 
+    Args:
+        name (str=CREDENTIALS_SECTION): Credential set name (see `get_credential_names()`)
+
     Returns:
         str: Token string
 
@@ -30,7 +97,7 @@ def get_token():
     """
     # Get config params
     try:
-        cfg = config.get('twitter')
+        cfg = config.get(name)
     except Exception as ex:
         raise Exception('Cannot get twitter configuration: %s' % ex)
 
@@ -47,75 +114,116 @@ def get_token():
     return token
 
 
-def get_api():
-    """Get Twitter API instance
+def get_api(name=CREDENTIALS_SECTION):
+    """Get process-wide Twitter API instance for given credential set, creating it on first call or after fork
+    The instance keeps its HTTP session (and pooled keep-alive connections) for the whole process lifetime,
+    so configuration is read and TLS handshake is made only once, not on every search request
+
+    Request timeout is read from `timeout` param of credential set config section (in seconds)
+
+    Args:
+        name (str=CREDENTIALS_SECTION): Credential set name (see `get_credential_names()`)
 
     Returns:
         twython.Twython
 
+    Raises:
+        Exception: Cannot get twitter configuration
+    """
+    global _apis, _apis_pid
+
+    pid = os.getpid()
+    if _apis_pid == pid and name in _apis:
+        return _apis[name]
+
+    with _api_lock:
+        # Instances created before fork cannot be used (their connections are shared with the parent process)
+        if _apis_pid != pid:
+            _apis = {}
+            _apis_pid = pid
+
+        # Other thread may have created the instance while we were waiting for the lock
+        if name in _apis:
+            return _apis[name]
+
+        try:
+            cfg = config.get(name)
+            timeout = float(cfg.get('timeout', API_TIMEOUT_DEFAULT))
+            credentials_count = len(get_credential_names())
+        except Exception as ex:
+            raise Exception('Cannot get twitter configuration: %s' % ex)
+
+        # Any of the fetchers (`FETCH_WORKERS` per credential set) may send its request with this credential set
+        _apis[name] = create_api(cfg['app_key'], cfg['access_token'], timeout,
+                                 FETCH_WORKERS * max(credentials_count, 1))
+
+    return _apis[name]
+
+
+def get_bucket(name=CREDENTIALS_SECTION):
+    """Get rate limiting token bucket params for given credential set
+    Bucket is named by the app key, so it is shared by all collectors using the same app, whatever config they have
+
+    Requests limit per 15 minutes window and bucket capacity (allowed burst) are read from `rate_limit`
+    and `bucket_capacity` params of credential set config section
+
+    Args:
+        name (str=CREDENTIALS_SECTION): Credential set name (see `get_credential_names()`)
+
+    Returns:
+        tuple: (bucket name, rate in tokens per second, capacity), see `storage.acquire_token()`
+
     Raises:
         Exception: Cannot get twitter configuration
     """
     try:
-        cfg = config.get('twitter')
+        cfg = config.get(name)
+        rate = float(cfg.get('rate_limit', RATE_LIMIT_DEFAULT)) / RATE_LIMIT_WINDOW
+        capacity = int(cfg.get('bucket_capacity', BUCKET_CAPACITY_DEFAULT))
     except Exception as ex:
         raise Exception('Cannot get twitter configuration: %s' % ex)
 
-    return Twython(cfg['app_key'], access_token=cfg['access_token'])
+    return 'twitter:%s' % cfg['app_key'], rate, capacity
 
 
-def assemble_collection():
-    """Assemble the collection of sequential tweets forming the text"""
+def create_api(app_key, access_token, timeout=API_TIMEOUT_DEFAULT, pool_size=FETCH_WORKERS):
+    """Create Twitter API instance with connection pool large enough for all fetchers
 
-    def count_vain_request():
-        """Increment counter for requests without any result, and reset productive requests counter
-        Also disable priority hashtag mode if there were too many vain hashtag requests
-        """
-        request_counters['vain'] += 1
-        request_counters['productive'] = 0
-        if hashtag_mode['enabled'] and (request_counters['vain'] >= VAIN_HASHTAG_REQUESTS_MAX):
-            hashtag_mode['enabled'] = False
-
-    def count_productive_request():
-        """Increment counter for requests having at least one result, and reset vain requests counter
-        Also re-enable priority hashtag mode if it was disabled previously
-        """
-        request_counters['productive'] += 1
-        request_counters['vain'] = 0
-        if not hashtag_mode['enabled']:
-            hashtag_mode['enabled'] = True
-
-    def set_collected_words_count(count):
-        """Store number of words found with last request
+    Args:
+        app_key (str): Application key
+        access_token (str): OAuth 2.0 access token
+        timeout (float=API_TIMEOUT_DEFAULT): Request timeout in seconds
+        pool_size (int=FETCH_WORKERS): Number of keep-alive connections (number of fetchers using the instance)
 
-        Args:
-            count (int)
-        """
-        request_counters['words_in_last'] = count
-        if count:
-            count_productive_request()
-        else:
-            count_vain_request()
+    Returns:
+        twython.Twython
+    """
+    twitter = Twython(app_key, access_token=access_token, client_args={'timeout': timeout})
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    twitter.client.mount('https://', adapter)
+    return twitter
 
-    def is_hashtag_mode():
-        """Report if priority hashtag mode should be enabled in the next request
 
-        Returns:
-            bool
-        """
-        return hashtag_mode['enabled']
+def assemble_collection(resume=True, stream=None):
+    """Assemble the collection of sequential tweets forming the text
+    Tweets are fetched with search requests, or received from the stream if given
 
-    def is_focus_mode():
-        """Report if focus mode should be enabled in the next request
+    Args:
+        resume (bool=True): Resume from the checkpoint of interrupted process if exists (start from scratch otherwise)
+        stream (bowie.stream.Transport=None): Stream of tweets to collect words from as they arrive
 
-        Returns:
-            bool
-        """
-        return request_counters['vain'] >= VAIN_REQUESTS_UNTIL_FOCUS
+    Raises:
+        Exception: Stream ended before all words were collected (progress is saved, so the process can be resumed)
+    """
 
-    def get_searched_words():
+    def get_searched_words(mode):
         """Provide a list of words to be searched next
         Also provide a search query for twitter, optimized by excluding non-unique words
+        Query is packed with as many following words as fit into query length and operators limits
+        (see `QUERY_LENGTH_MAX` and `QUERY_OPERATORS_MAX`), and into query width of given mode
+
+        Args:
+            mode (str): Query mode (see `strategy.MODES`)
 
         Raises:
             KeyError: Cannot get primary search word
@@ -125,42 +233,49 @@ def assemble_collection():
             list of str: ['Three', 'unsearched', 'words']
             str: 'Three OR unsearched OR words'
         """
-        def add_word(word):
+        def add_word(index):
             """Add word to `searched_words`
-            Also add word to `query_words` if its normalized version is unique
+            Also add word to `query_words` if its normalized version is unique, unless query becomes too long
+
+            Returns:
+                bool: Whether the word was added
             """
-            searched_words.append(word)
-            normalized = normalize_string(word)
+            normalized = normalized_words[index]
             if normalized not in query_words:
+                if width is not None and len(query_words) >= width:
+                    return False
+                if len(query_words) > QUERY_OPERATORS_MAX:
+                    return False
+                if len(query_words) > 0 and len(build_query(query_words + [normalized], hashtag)) > QUERY_LENGTH_MAX:
+                    return False
                 query_words.append(normalized)
+            searched_words.append(words[index])
+            return True
 
         # Prepare empty list for searched words
         searched_words = []
         query_words = []
+        hashtag = strategy.get_params(mode)['hashtag']
+        width = strategy.get_params(mode)['width']
 
         # Determine index of first unsearched word and store word's content
         index = last_word_data['index'] + 1
         try:
-            add_word(words[index])
+            add_word(index)
         except (IndexError, KeyError) as ex:
             raise KeyError('Cannot get primary search word: %s' % ex)
 
-        # If focus mode is disabled, also list some following words to be searched for
-        if not is_focus_mode():
-            while (index < words_last_index) and (len(query_words) < WORDS_PER_REQUEST):
-                index += 1
-                try:
-                    add_word(words[index])
-                except (IndexError, KeyError) as ex:
-                    raise KeyError('Cannot get secondary search word: %s' % ex)
-
-        # Build search query for `q` twitter search param
-        if is_hashtag_mode():
-            query_words = map(lambda word: word + ' ' + PRIORITY_HASHTAG, query_words)
-        query = ' OR '.join(query_words)
+        # Also list as many following words to be searched for as query can fit
+        while index < words_last_index:
+            index += 1
+            try:
+                if not add_word(index):
+                    break
+            except (IndexError, KeyError) as ex:
+                raise KeyError('Cannot get secondary search word: %s' % ex)
 
-        # Return the list of words to be searched
-        return searched_words, query
+        # Return the list of words to be searched, and search query for `q` twitter search param
+        return searched_words, build_query(query_words, hashtag)
 
     def filter_older_posts(post):
         """Callback for filtering out the posts which are older than last collected one
@@ -178,111 +293,145 @@ def assemble_collection():
         else:
             return parse_twitter_time(post['created_at']) > last_word_data['time']
 
-    def normalize_string(string):
-        """Convert string to lowercase and remove diacritics
+    def fetch_next_results(credential):
+        """Fetch next tweet results from Twitter search, and process them (see `process_results()`)
+        Searched words and query are determined under the state lock, but the request itself is made without it,
+        so several fetchers can wait for responses simultaneously
 
         Args:
-            string (str): Input string
-        """
-        return txtools.remove_diacritics(string.lower())
-
-    def fetch_next_results():
-        """Fetch next tweet results from Twitter search
+            credential (str): Name of credential set to make the request with (see `get_credential_names()`)
 
         Raises:
             ValueError: No words to search for
             Exception: Cannot fetch Twitter search results
-            ValueError: Tweets data not found in search results
-            Exception: Cannot normalize searched word
-            Exception: Cannot remove usernames and hyperlinks from post text
-            Exception: Cannot split post text into words
-            Exception: Cannot normalize words from post text
-            Exception: Cannot preprocess matching post data
-            Exception: Cannot enqueue tweet data for saving to database
 
         Todo:
             Make real-time print reporting optional?
         """
 
         # Get next words to be searched
-        searched_words, query = get_searched_words()
-        if len(searched_words) < 1:
-            raise ValueError('No words to search for')
-
-        # Prepare search params
-        params = {
-            'q': query,
-            'result_type': 'recent',
-            'count': ITEMS_PER_REQUEST,
-            'rnd': time.mktime(time.gmtime()),
-        }
-        if last_word_data['tweet_id'] is not None:
-            params['since_id'] = last_word_data['tweet_id']
-
-        # Report search query
-        print('  ~ [%s] Searching for: %s' % (get_formatted_time(time.gmtime()), params['q']))
+        with state_lock:
+            # Nothing to do if all words were collected while the request was waiting for a free fetcher
+            if last_word_data['index'] >= words_count - 1:
+                return
+
+            mode, reason = strategies.choose()
+            searched_words, query = get_searched_words(mode)
+            if len(searched_words) < 1:
+                raise ValueError('No words to search for')
+            last_searched_index = last_word_data['index'] + len(searched_words)
+
+            # Prepare search params
+            params = {
+                'q': query,
+                'result_type': 'recent',
+                'count': ITEMS_PER_REQUEST,
+                'rnd': time.mktime(time.gmtime()),
+            }
+            if last_word_data['tweet_id'] is not None:
+                params['since_id'] = last_word_data['tweet_id']
+
+        # Report search query and requests budget
+        scheduler = schedulers.get(credential)
+        status = scheduler.get_status()
+        budget = ('%d requests left' % status['remaining']) if status['remaining'] is not None else 'unknown budget'
+        print('  ~ [%s] Searching for: %s (%s mode, %s; %s: %s, %.1f s interval)' %
+              (get_formatted_time(time.gmtime()), params['q'], mode, reason, credential, budget, status['interval']))
 
         # Initialize Twitter API instance
-        twitter = get_api()
+        twitter = get_api(credential)
+
+        # Take a token from the credential set's bucket, shared with other collector processes
+        try:
+            storage.acquire_token(*buckets[credential])
+        except Exception as ex:
+            raise Exception('Storage error when acquiring rate limit token: %s' % ex)
 
-        # Get Twitter search results
+        # Get Twitter search results, measuring request latency
+        request_time_begin = time.time()
         try:
             result = twitter.search(**params)
+        except TwythonRateLimitError as ex:
+            scheduler.backoff(ex.retry_after)
+            raise Exception('Twitter search rate limit exceeded, requests suspended: %s' % ex)
         except Exception as ex:
             raise Exception('Cannot fetch Twitter search results: %s' % ex)
+        finally:
+            request_latencies.append(time.time() - request_time_begin)
+
+        # Update requests budget with rate limit headers
+        # (API instance is shared between fetchers, so headers may belong to a concurrent request of the same window)
+        try:
+            scheduler.update(twitter.get_lastfunction_header('x-rate-limit-remaining'),
+                             twitter.get_lastfunction_header('x-rate-limit-reset'))
+        except Exception as ex:
+            print('[ERROR!] Cannot read rate limit headers: %s' % ex)
+
+        # Process results against the current state (other fetcher may have collected some words meanwhile)
+        with state_lock:
+            process_results(result, last_searched_index, mode, reason)
+
+    def process_results(result, last_searched_index, mode, reason):
+        """Add posts from Twitter search results to the cache, then collect following words from cached posts
+        Must be called with the state lock acquired
+
+        Args:
+            result (dict): Twitter search results
+            last_searched_index (int): Index of the last word searched with the request
+            mode (str): Query mode of the request (see `strategy.MODES`)
+            reason (str): Reason the query mode was chosen for (see `strategy.REASONS`)
+
+        Raises:
+            ValueError: Tweets data not found in search results
+            Exception: Cannot cache posts (see `PostCache.add()`)
+            Exception: Cannot collect words from cached posts (see `collect_cached_words()`)
+        """
 
         # Get posts data from result fetched
         try:
-            # Reverse posts to have newest on top
-            posts = reversed(result['statuses'])
+            posts = result['statuses']
         except Exception as ex:
             raise ValueError('Tweets data not found in search results: %s' % ex)
 
-        # Collected words counter
-        collected_words_count = 0
+        # Cache posts indexed by normalized words they contain (even if searched words were already collected
+        # by results of another request, posts may contain following words)
+        post_cache.add(posts)
 
-        # Cycle through searched words to determine which ones are found
-        for word in searched_words:
-            # Make word lowercase and remove diacritic signs (trying to emulate Twitter search approach within results)
-            # TODO Investigate, check and possibly improve this emulation algorithm (may be unreliable for now)
-            try:
-                word_normalized = normalize_string(word)
-            except Exception as ex:
-                raise Exception('Cannot normalize searched word: %s' % ex)
+        # Collect searched words, and following words if cached posts contain them
+        response_is_stale = last_word_data['index'] >= last_searched_index
+        collected_words_count = collect_cached_words()
 
-            # Filter posts to remove ones older than last matched tweet (or older than assemble begin time)
-            posts = filter(filter_older_posts, posts)
+        # Record query mode yield (unless the response came too late to be taken into account)
+        if not response_is_stale:
+            strategies.record(mode, reason, collected_words_count)
 
-            # Cycle through posts to get the newest one that matches current word
-            matching_post = None
-            for post in posts:
+    def collect_cached_words():
+        """Collect uncollected words one by one from cached posts, until a word cannot be found
+        So posts fetched in response to earlier searches may satisfy following words without new search requests
 
-                # Remove usernames and hyperlinks from post text
-                try:
-                    text_nolinks = re.sub(ur'(^|\s)(https://t\.co/\S+|@[a-zA-Z0-9_]+)', '', post['text'], re.UNICODE)
-                except BaseException as ex:
-                    raise Exception('Cannot remove usernames and hyperlinks from post text: %s' % ex)
+        Returns:
+            int: Collected words count
 
-                # Split post text into words
-                try:
-                    words_original = txtools.split_to_words(text_nolinks)
-                except BaseException as ex:
-                    raise Exception('Cannot split post text into words: %s' % ex)
+        Raises:
+            Exception: Cannot preprocess matching post data
+            Exception: Cannot enqueue tweet data for saving to database
+        """
 
-                # Nothing to do if no words extracted
-                if len(words_original) < 1:
-                    continue
+        # Collected words counter
+        collected_words_count = 0
 
-                # Convert extracted words to lowercase and remove diacritics
-                try:
-                    words_normalized = map(normalize_string, words_original)
-                except Exception as ex:
-                    raise Exception('Cannot normalize words from post text: %s' % ex)
+        # Cycle through uncollected words to determine which ones are found
+        while last_word_data['index'] < words_count - 1:
+            index = last_word_data['index'] + 1
+            word = words[index]
 
-                # If post's words contain searched word, this post is the match; stop further post cycling for this word
-                if word_normalized in words_normalized:
-                    matching_post = post
-                    break
+            # Get word made lowercase and without diacritic signs (trying to emulate Twitter search approach)
+            # TODO Investigate, check and possibly improve this emulation algorithm (may be unreliable for now)
+            word_normalized = normalized_words[index]
+
+            # Get the earliest cached post containing the word, which is newer than last matched tweet
+            # (or newer than assemble begin time)
+            matching_post = post_cache.find(word_normalized, filter_older_posts)
 
             # If matching post is found
             if matching_post is not None:
@@ -294,14 +443,6 @@ def assemble_collection():
                 except Exception as ex:
                     raise Exception('Cannot preprocess matching post data: %s' % ex)
 
-                # Enqueue data for database save
-                try:
-                    queue.put({
-                        'tweet_data': json.dumps(matching_post),
-                    })
-                except Exception as ex:
-                    raise Exception('Cannot enqueue tweet data for saving to database: %s' % ex)
-
                 # Refresh last post data
                 last_word_data['tweet_id'] = matching_post['id']
                 last_word_data['time'] = parse_twitter_time(matching_post['created_at'])
@@ -309,59 +450,141 @@ def assemble_collection():
                 last_word_data['index'] += 1
                 last_word_data['collect_time_begin'] = collect_time_end
 
+                # Enqueue data for database save, along with the progress checkpoint to be saved with it
+                try:
+                    queue.put({
+                        'tweet_data': encode_record(make_record(matching_post)),
+                        'checkpoint': make_checkpoint(),
+                    })
+                except Exception as ex:
+                    raise Exception('Cannot enqueue tweet data for saving to database: %s' % ex)
+
                 # Count and report word collect success
                 collected_words_count += 1
                 collect_time_end_formatted = get_formatted_datetime(collect_time_end)
                 print('[+] Collected word "%s" (%d of %d) at %s GMT' %
                       (word, last_word_data['ordinal'], words_count, collect_time_end_formatted))
 
-            # If no matching post found for the word, skip all following searched words (otherwise sequence will break)
+            # If no matching post found for the word, stop (otherwise sequence will break)
             else:
                 break
 
-        # Save results statistics
-        set_collected_words_count(collected_words_count)
+        return collected_words_count
 
-    def results_saver():
-        """Worker that continuously reads enqueued tweet fetch results and saves them into database
+    def make_checkpoint():
+        """Snapshot collection progress to be stored along with the collected items
+
+        Returns:
+            dict: JSON-serializable progress data (see `restore_checkpoint()`)
+        """
+        return {
+            'words_count': words_count,
+            'words_digest': words_digest,
+            'index': last_word_data['index'],
+            'ordinal': last_word_data['ordinal'],
+            'time': calendar.timegm(last_word_data['time']),
+            'tweet_id': last_word_data['tweet_id'],
+            'collect_time_begin': calendar.timegm(last_word_data['collect_time_begin']),
+            'strategy': strategies.get_state(),
+        }
+
+    def restore_checkpoint(checkpoint):
+        """Restore collection progress from checkpoint
+
+        Args:
+            checkpoint (dict): Progress data (see `make_checkpoint()`)
+        """
+        last_word_data['index'] = checkpoint['index']
+        last_word_data['ordinal'] = checkpoint['ordinal']
+        last_word_data['time'] = time.gmtime(checkpoint['time'])
+        last_word_data['tweet_id'] = checkpoint['tweet_id']
+        last_word_data['collect_time_begin'] = time.gmtime(checkpoint['collect_time_begin'])
+        if 'strategy' in checkpoint:
+            strategies.set_state(checkpoint['strategy'])
+
+    def consume_stream():
+        """Add each tweet received from the stream to the cache and collect following words, as tweets arrive
+        Tweets not containing any word of the text are skipped
+
+        Returns:
+            bool: Whether all words are collected (False if the stream ended before)
 
         Raises:
-            Exception: Cannot connect to database
-            Exception: Database error when updating word entry
-            Exception: Exactly 1 (one) word entry expected to be updated
-            Exception: Database error when updating text entry
-            Exception: Exactly 1 (one) text entry expected to be updated
-            Exception: Database error when committing changes
+            Exception: Cannot read tweets stream
         """
-        while True:
+        text_words = set(normalized_words)
+        try:
+            for post in stream:
+                with state_lock:
+                    post_cache.add([post], text_words)
+                    collect_cached_words()
+                    if last_word_data['index'] >= words_last_index:
+                        return True
+        except Exception as ex:
+            raise Exception('Cannot read tweets stream: %s' % ex)
+        finally:
+            stream.close()
 
-            # Initialize `data` variable
-            data = None
+        return False
 
-            # Catch any exception inside cycle to keep worker alive
+    def results_fetcher():
+        """Worker that makes a new search with each dispatched credential set name, until False signal is received
+        Errors are reported without stopping the worker
+        """
+        while True:
+            credential = dispatch.get()
+            if credential is False:
+                break
             try:
-                # Get next queued item
-                data = queue.get()
+                fetch_next_results(credential)
+            except Exception as ex:
+                print('[ERROR!] %s' % ex)
 
-                # If item is False, finish the process
-                if not data:
-                    exit(0)
+    def results_saver():
+        """Worker that continuously reads enqueued tweet fetch results and saves them into database
+        Items enqueued within `SAVER_BATCH_WINDOW` seconds are saved together with a single pipelined write
+        (atomically with the checkpoint of the last item, so stored progress always matches stored items)
+        A failed batch is retried in place (keeping words order) until it is saved
+        """
+        finished = False
+        while not finished:
+
+            # Wait for the first item of the next batch
+            batch = []
+            data = queue.get()
+            deadline = time.time() + SAVER_BATCH_WINDOW
+
+            # Drain all items enqueued within the batch window
+            while data:
+                batch.append(data)
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    data = queue.get(timeout=timeout)
+                except Empty:
+                    break
 
-                # Connect to database (new connection for each queue item to avoid connection timeouts)
+            # If item is False, finish the process after saving the batch
+            if not data:
+                finished = True
+
+            # Save batch items, retrying the same batch on failure
+            while batch:
                 try:
-                    storage.append_upcoming_item(data['tweet_data'])
+                    storage.append_upcoming_items([item['tweet_data'] for item in batch], batch[-1]['checkpoint'])
                 except Exception as ex:
-                    raise Exception('Cannot append upcoming collection item: %s' % ex)
+                    print('[ERROR!] Cannot append upcoming collection items: %s' % ex)
+                    time.sleep(SAVER_RETRY_INTERVAL)
+                    continue
+                for _ in batch:
+                    queue.task_done()
+                batch = []
 
+            # Stop signal item is also done
+            if finished:
                 queue.task_done()
 
-            # If exception occurs, output error message and put fetched data back to queue
-            # TODO Not the best way, because first queue item becomes last
-            except Exception as ex:
-                print('[ERROR!] %s' % ex)
-                if data is not None:
-                    queue.put(data)
-
     # Main process
     # TODO Move to separate method?
 
@@ -373,7 +596,6 @@ def assemble_collection():
     print('Process started at %s GMT' % get_formatted_datetime(time_begin))
 
     # Get words list
-    # TODO Get only uncollected words (to enable aborted process resume)?
     try:
         words = storage.get_words()
     except Exception as ex:
@@ -383,18 +605,18 @@ def assemble_collection():
     words_count = len(words)
     if words_count < 1:
         raise Exception('No words to collect')
+    words_digest = get_words_digest(words)
 
-    # Thread-accessible storage for request statistics counters
-    request_counters = {
-        'productive': 0,
-        'vain': 0,
-        'words_in_last': 0,
-    }
+    # Get normalized words list (normalize words here if they were stored without normalized list)
+    try:
+        normalized_words = storage.get_normalized_words()
+    except Exception as ex:
+        raise Exception('Storage error when getting normalized words list: %s' % ex)
+    if len(normalized_words) != words_count:
+        normalized_words = txtools.normalize_many(words)
 
-    # Thread-accessible value indicating whether priority hashtag mode is enabled
-    hashtag_mode = {
-        'enabled': True,
-    }
+    # Query mode selector, choosing the mode collecting most words per request recently
+    strategies = strategy.StrategySelector()
 
     # Prepare initial data
     first_word_ordinal = 1
@@ -406,12 +628,41 @@ def assemble_collection():
         'collect_time_begin': time_begin,
     }
 
-    # Clear upcoming collection
-    # TODO Only do that on forced restart
-    try:
-        storage.clear_upcoming_collection()
-    except Exception as ex:
-        raise Exception('Storage error when clearing upcoming collection: %s' % ex)
+    # Get checkpoint of interrupted process
+    checkpoint = None
+    if resume:
+        try:
+            checkpoint = storage.get_checkpoint()
+        except Exception as ex:
+            raise Exception('Storage error when getting checkpoint: %s' % ex)
+        if checkpoint is not None and (checkpoint['words_count'] != words_count or
+                                       checkpoint.get('words_digest') != words_digest):
+            print('Checkpoint was made for another words list, starting from scratch')
+            checkpoint = None
+
+    # Resume from checkpoint
+    if checkpoint is not None:
+        restore_checkpoint(checkpoint)
+        print('Resuming interrupted process from word %d of %d' % (last_word_data['ordinal'] + 1, words_count))
+
+    # Or clear upcoming collection (and its checkpoint) to start from scratch
+    else:
+        try:
+            storage.clear_upcoming_collection()
+        except Exception as ex:
+            raise Exception('Storage error when clearing upcoming collection: %s' % ex)
+
+    # Index of the last word of the text
+    words_last_index = words_count - 1
+
+    # Recent posts indexed by normalized words, to collect following words without new search requests
+    post_cache = PostCache(LOOKAHEAD_CACHE_SIZE)
+
+    # Search requests latencies (in seconds)
+    request_latencies = []
+
+    # Lock guarding collection state (`last_word_data`, `post_cache`) between fetchers
+    state_lock = threading.Lock()
 
     # Initialize messages queue between fetchers and saver
     queue = Queue()
@@ -421,21 +672,92 @@ def assemble_collection():
     saver.daemon = True
     saver.start()
 
-    # Invoke a new tweet fetcher at a given interval until all words are collected
-    words_last_index = words_count - 1
-    while last_word_data['index'] < words_last_index:
-        fetch = threading.Thread(target=fetch_next_results)
-        fetch.start()
-        time.sleep(REQUEST_INTERVAL)
-        fetch.join()  # TODO Need to terminate the fetcher at the end of interval -- does .join() really do the work?
+    # Collect words from tweets stream as they arrive
+    if stream is not None:
+        try:
+            completed = consume_stream()
+        except Exception:
+            queue.put(False)
+            saver.join()
+            raise
+
+    # Or fetch tweets with search requests
+    else:
+        # Get credential sets to rotate search requests across
+        try:
+            credentials = get_credential_names()
+        except Exception as ex:
+            raise Exception('Cannot get twitter credentials: %s' % ex)
 
-    # After all words are collected, send a signal to stop the database worker and join its thread
+        # Get rate limiting buckets of credential sets
+        try:
+            buckets = dict((credential, get_bucket(credential)) for credential in credentials)
+        except Exception as ex:
+            raise Exception('Cannot get twitter credentials: %s' % ex)
+
+        # Search requests schedulers for each credential set
+        # (`REQUEST_INTERVAL` is used until rate limit headers are received)
+        schedulers = ratelimit.SchedulerPool(credentials, REQUEST_INTERVAL)
+
+        # Start tweet fetching workers
+        dispatch = Queue(maxsize=1)
+        fetchers = []
+        for _ in range(FETCH_WORKERS * len(credentials)):
+            fetcher = threading.Thread(target=results_fetcher)
+            fetcher.daemon = True
+            fetcher.start()
+            fetchers.append(fetcher)
+
+        # Dispatch new searches until all words are collected, spreading the remaining rate limit budget evenly
+        # and rotating credential sets by their remaining budget
+        # (slow response does not delay following searches, as long as there is a free worker)
+        while last_word_data['index'] < words_last_index:
+
+            # Wait until the next request is due (re-checking periodically, as responses may change the schedule)
+            delay = schedulers.get_delay()
+            if delay > 0:
+                time.sleep(min(delay, SCHEDULE_CHECK_INTERVAL))
+                continue
+
+            # Wait for a free worker (dispatcher is the only producer, so the queue cannot get full after the check)
+            if dispatch.full():
+                time.sleep(min(schedulers.get_interval(), SCHEDULE_CHECK_INTERVAL))
+                continue
+
+            # Pass the request to the worker, with credential set having the largest remaining budget
+            credential = schedulers.acquire()
+            if credential is not None:
+                dispatch.put(credential)
+
+        # Stop fetching workers
+        for _ in fetchers:
+            dispatch.put(False)
+        for fetcher in fetchers:
+            fetcher.join()
+        completed = True
+
+    # After all words are collected (or stream ended), send a signal to stop the database worker and join its thread
     queue.put(False)
     saver.join()
 
-    # Push upcoming collection as new "recent" collection
+    # Collected items and progress checkpoint are saved, so the process can be resumed later
+    if not completed:
+        raise Exception('Stream ended before all words were collected (%d of %d), resume to continue' %
+                        (last_word_data['ordinal'], words_count))
+
+    # Pre-render API payloads for collections state after the shift
+    # (upcoming collection becomes "recent", "recent" one becomes "prev" unless it does not exist yet)
+    try:
+        recent_data = storage.get_recent_collection()
+        prev_data = recent_data if len(recent_data) > 0 else storage.get_prev_collection()
+        payloads = build_payloads(words, storage.get_upcoming_collection(), prev_data)
+    except Exception as ex:
+        print('[ERROR!] Cannot pre-render API payloads (will be rendered per request): %s' % ex)
+        payloads = {}
+
+    # Push upcoming collection as new "recent" collection, storing payloads for the new generation
     try:
-        storage.shift_collections()
+        generation = storage.shift_collections(payloads)
     except Exception as ex:
         raise Exception('Storage error when shifting collections: %s' % ex)
 
@@ -447,9 +769,397 @@ def assemble_collection():
     print('Assembled new collection')
     print('Process finished at %s GMT' % get_formatted_datetime(time_end))
     print('Collected %d words' % words_count)
+    if len(request_latencies) > 0:
+        print('Made %d search requests, latency min %d ms, avg %d ms, max %d ms' %
+              (len(request_latencies), min(request_latencies) * 1000,
+               sum(request_latencies) / len(request_latencies) * 1000, max(request_latencies) * 1000))
+    print('Collection generation: %d' % generation)
+    for mode, stats in sorted(strategies.get_stats().items()):
+        if stats['requests'] > 0:
+            print('Mode %-8s %4d requests, %5d words, %.2f words per request (recent %.2f)' %
+                  (mode, stats['requests'], stats['words'], float(stats['words']) / stats['requests'], stats['yield']))
+    for reason, stats in sorted(strategies.get_decisions().items()):
+        if stats['requests'] > 0:
+            print('Chosen as %-8s %4d requests, %5d words, %.2f words per request' %
+                  (reason, stats['requests'], stats['words'], float(stats['words']) / stats['requests']))
     print('====================\n')
 
 
+def get_words_digest(words):
+    """Get digest of words list, identifying the text collection process checkpoint was made for
+
+    Args:
+        words (list of str): Words list (as stored, UTF-8 encoded)
+
+    Returns:
+        str: Hexadecimal SHA-1 digest
+    """
+    digest = hashlib.sha1()
+    for word in words:
+        digest.update(word)
+        digest.update('\n')
+    return digest.hexdigest()
+
+
+def build_query(query_words, hashtag_mode=False):
+    """Build search query for `q` twitter search param, matching any of given words
+
+    Args:
+        query_words (list of unicode): Normalized words
+        hashtag_mode (bool=False): Require priority hashtag along with each word
+
+    Returns:
+        unicode: u'three OR unsearched OR words' or u'three #singwithbowie OR words #singwithbowie'
+    """
+    if hashtag_mode:
+        query_words = [word + ' ' + PRIORITY_HASHTAG for word in query_words]
+    return ' OR '.join(query_words)
+
+
+def get_post_words(post):
+    """Extract normalized words from post text, skipping usernames and hyperlinks (see `txtools.normalize()`)
+
+    Args:
+        post (dict): Tweet data from Twitter search results
+
+    Returns:
+        list of unicode
+
+    Raises:
+        Exception: Cannot extract words from post text
+    """
+    try:
+        return txtools.split_post_to_words(post['text'], normalized=True)
+    except BaseException as ex:
+        raise Exception('Cannot extract words from post text: %s' % ex)
+
+
+class PostCache(object):
+    """Bounded cache of recent posts indexed by normalized words they contain
+    When cache size is exceeded, posts cached earliest are evicted
+
+    Attributes:
+        size (int): Maximum number of cached posts
+    """
+    def __init__(self, size):
+        self.size = size
+        self._posts = OrderedDict()
+        self._index = {}
+
+    def __len__(self):
+        return len(self._posts)
+
+    def add(self, posts, relevant_words=None):
+        """Add posts to the cache (already cached ones are skipped), extracting each post's words only once
+
+        Args:
+            posts (iterable of dict): Tweets data from Twitter search results
+            relevant_words (set of unicode=None): If given, posts containing none of these words are skipped
+
+        Raises:
+            Exception: Cannot extract post words (see `get_post_words()`)
+        """
+        for post in posts:
+            if post['id'] in self._posts:
+                continue
+            post_words = set(get_post_words(post))
+            if relevant_words is not None and relevant_words.isdisjoint(post_words):
+                continue
+            self._posts[post['id']] = (post, post_words)
+            for word in post_words:
+                bisect.insort(self._index.setdefault(word, []), post['id'])
+
+        # Evict posts cached earliest
+        while len(self._posts) > self.size:
+            post_id, (post, post_words) = self._posts.popitem(last=False)
+            for word in post_words:
+                post_ids = self._index[word]
+                post_ids.remove(post_id)
+                if len(post_ids) < 1:
+                    del self._index[word]
+
+    def find(self, word, is_eligible):
+        """Get the earliest (by tweet ID) cached post containing given word and satisfying given condition
+
+        Args:
+            word (unicode): Normalized word
+            is_eligible (callable): Condition function, accepting post and returning bool
+
+        Returns:
+            dict or None: Tweet data (None if not found)
+        """
+        for post_id in self._index.get(word, ()):
+            post = self._posts[post_id][0]
+            if is_eligible(post):
+                return post
+        return None
+
+
+def build_payloads(words, recent_data, prev_data):
+    """Pre-render API response bodies for given collections (see `/api/collections/` and `/api/stat/`)
+
+    Args:
+        words (list of str): Words list
+        recent_data (list of str): Stored items (encoded tweet records) of recent collection
+        prev_data (list of str): Stored items (encoded tweet records) of previous collection
+
+    Returns:
+        dict of (str: str): {'collections': '{"recent": [...], ...}', 'stat': '{"recent": {...}, ...}'}
+
+    Raises:
+        TweetDataError: Tweet data cannot be processed
+    """
+    return {
+        'collections': encode_payload(build_collections(words, recent_data, prev_data)),
+        'stat': encode_payload(build_stat(words, recent_data, prev_data)),
+    }
+
+
+def encode_payload(result):
+    """Serialize API result data to UTF-8 JSON string
+
+    Args:
+        result (dict)
+
+    Returns:
+        str
+    """
+    return json.dumps(result, ensure_ascii=False).encode('utf8')
+
+
+def build_collections(words, recent_data=None, prev_data=None):
+    """Build data for previous and recent tweet collections
+
+    Args:
+        words (list of str): Words list (aligned with collections items)
+        recent_data (list of str=None): Stored items (encoded tweet records) of recent collection
+        prev_data (list of str=None): Stored items (encoded tweet records) of previous collection
+
+    Returns:
+        dict: {'recent': [{'word': 'Foo', 'tweet_url': ..., ...}, ...], 'prev': [...]}
+              (collections passed as None are omitted)
+
+    Raises:
+        TweetDataError: Tweet data cannot be processed
+    """
+    result = {}
+
+    # List tweets data
+    for key, data in {'recent': recent_data, 'prev': prev_data}.items():
+
+        if data is None:
+            continue
+
+        result[key] = []
+        for i, item in enumerate(data):
+
+            # Decode tweet record
+            try:
+                record = decode_record(item)
+            except:
+                raise TweetDataError('Tweet data error', 400)
+
+            # Build tweet URL
+            try:
+                tweet_url = get_record_url(record)
+            except:
+                raise TweetDataError('Tweet data error', 401)
+
+            # Get tweet author screen name
+            try:
+                tweet_author = record['screen_name']
+            except:
+                raise TweetDataError('Tweet data error', 402)
+
+            # Format tweet time
+            try:
+                tweet_timestamp = record['timestamp']
+                tweet_time = get_formatted_datetime(time.gmtime(tweet_timestamp))
+            except:
+                raise TweetDataError('Tweet data error', 403)
+
+            # Get tweet text
+            try:
+                tweet_content = record['text']
+            except:
+                raise TweetDataError('Tweet data error', 404)
+
+            # Get tweet hashtags
+            try:
+                tweet_hashtags = ['#' + hashtag for hashtag in record['hashtags']]
+            except:
+                raise TweetDataError('Tweet data error', 405)
+
+            # Prevent broken collection response if words changed recently
+            try:
+                word = words[i]
+            except:
+                word = '(Unknown)'
+
+            # Append item to results list
+            result[key].append({
+                'word': word,
+                'tweet_url': tweet_url,
+                'tweet_author': tweet_author,
+                'tweet_time': tweet_time,
+                'tweet_timestamp': tweet_timestamp,
+                'tweet_content': tweet_content,
+                'tweet_hashtags': tweet_hashtags,
+            })
+
+    return result
+
+
+def build_stat(words, recent_data, prev_data, slowest=STAT_SLOWEST_DEFAULT):
+    """Build statistical data for previous and recent tweet collections
+
+    Args:
+        words (list of str): Words list
+        recent_data (list of str): Stored items (encoded tweet records) of recent collection
+        prev_data (list of str): Stored items (encoded tweet records) of previous collection
+        slowest (int=STAT_SLOWEST_DEFAULT): Slowest words output count
+
+    Returns:
+        dict: {'recent': {'first_tweet_time': ..., 'slowest_words': [...], ...}, 'prev': {...}}
+              (empty collections are omitted)
+
+    Raises:
+        TweetDataError: Tweet data cannot be processed
+    """
+    result = {}
+
+    # Process tweets data
+    for key, data in {'recent': recent_data, 'prev': prev_data}.items():
+
+        prev_tweet_timestamp = None
+        tweets_data = []
+
+        for i, item in enumerate(data):
+
+            # Decode tweet record
+            try:
+                record = decode_record(item)
+            except:
+                raise TweetDataError('Tweet data error', 400)
+
+            # Build tweet URL
+            try:
+                tweet_url = get_record_url(record)
+            except:
+                raise TweetDataError('Tweet data error', 401)
+
+            # Format tweet time
+            try:
+                tweet_timestamp = record['timestamp']
+                tweet_time = get_formatted_datetime(time.gmtime(tweet_timestamp))
+            except:
+                raise TweetDataError('Tweet data error', 403)
+
+            # Get tweet hashtags
+            try:
+                tweet_hashtags = ['#' + hashtag for hashtag in record['hashtags']]
+            except:
+                raise TweetDataError('Tweet data error', 405)
+
+            # Consider first tweet was collected immediately (no prev tweet data)
+            if i == 0:
+                prev_tweet_timestamp = tweet_timestamp
+
+            # Prevent broken collection response if words changed recently
+            try:
+                word = words[i]
+            except:
+                word = '(Unknown)'
+
+            # Append item to results list
+            tweets_data.append({
+                'word': word + ' (#%d)' % i,
+                'tweet_url': tweet_url,
+                'tweet_hashtags': tweet_hashtags,
+                'tweet_time': tweet_time,
+                'tweet_timestamp': tweet_timestamp,
+                'tweet_time_delta': tweet_timestamp - prev_tweet_timestamp,
+            })
+
+            prev_tweet_timestamp = tweet_timestamp
+
+        # Nothing to report for empty collection
+        if len(tweets_data) < 1:
+            continue
+
+        # Save result item
+        result[key] = {
+            'first_tweet_time': tweets_data[0]['tweet_time'],
+            'last_tweet_time': tweets_data[-1]['tweet_time'],
+            'collect_duration': tweets_data[-1]['tweet_timestamp'] - tweets_data[0]['tweet_timestamp'],
+            'slowest_words': list(sorted(tweets_data, key=lambda item: -item['tweet_time_delta'])[:slowest]),
+        }
+
+    return result
+
+
+def make_record(tweet_data):
+    """Project full tweet data to compact record containing only the fields used by API
+
+    Args:
+        tweet_data (dict): Tweet's parsed JSON data
+
+    Returns:
+        dict: {'id_str': '123', 'screen_name': 'foo', 'timestamp': 1219842525, 'text': 'Bar', 'hashtags': ['baz']}
+    """
+    return {
+        'id_str': tweet_data['id_str'],
+        'screen_name': tweet_data['user']['screen_name'],
+        'timestamp': int(calendar.timegm(parse_twitter_time(tweet_data['created_at']))),
+        'text': tweet_data['text'],
+        'hashtags': [hashtag_data['text'] for hashtag_data in tweet_data['entities']['hashtags']],
+    }
+
+
+def encode_record(record):
+    """Encode tweet record for storage as minimal JSON array
+
+    Args:
+        record (dict): Tweet record (see `make_record()`)
+
+    Returns:
+        str: '[1,"123","foo",1219842525,"Bar",["baz"]]'
+    """
+    return json.dumps([RECORD_VERSION, record['id_str'], record['screen_name'], record['timestamp'],
+                       record['text'], record['hashtags']], ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+
+def decode_record(item):
+    """Decode stored tweet record
+    Legacy items (full tweet JSON objects) are also accepted and projected to record
+
+    Args:
+        item (str): Stored item (see `encode_record()`)
+
+    Returns:
+        dict: Tweet record (see `make_record()`)
+
+    Raises:
+        ValueError: Unknown tweet record format
+    """
+    data = json.loads(item)
+
+    # Legacy full tweet data
+    if isinstance(data, dict):
+        return make_record(data)
+
+    # Compact record
+    if data[0] != RECORD_VERSION:
+        raise ValueError('Unknown tweet record version: %s' % data[0])
+    return {
+        'id_str': data[1],
+        'screen_name': data[2],
+        'timestamp': data[3],
+        'text': data[4],
+        'hashtags': data[5],
+    }
+
+
 def convert_twitter_time(twitter_time):
     """Convert 'created_at' value of tweet into DATETIME format
     Taken from: http://stackoverflow.com/a/7711869
@@ -514,3 +1224,8 @@ def get_formatted_time(time_struct):
 # Build tweet URL from tweet data
 def get_tweet_url(tweet_data):
     return 'https://twitter.com/%s/status/%s' % (tweet_data['user']['screen_name'], tweet_data['id_str'])
+
+
+# Build tweet URL from tweet record
+def get_record_url(record):
+    return 'https://twitter.com/%s/status/%s' % (record['screen_name'], record['id_str'])
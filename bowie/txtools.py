@@ -1,7 +1,63 @@
 """Text parsing and processing tools"""
+from array import array
+from itertools import izip
 import re
 
 
+NORMALIZE_CACHE_SIZE = 10000
+"""(int): Maximum number of texts memoized by `normalize()` (same words recur in posts all the time)"""
+
+ASCII_MAX = 0x7E
+"""(int): Last codepoint left untouched by `remove_diacritics()`"""
+
+NORMALIZE_SEPARATOR = u'\n'
+"""(unicode): Separator of texts joined by `normalize_many()` (is kept as is by normalization, words never contain it)"""
+
+normalize_cache = [{}, {}]
+"""(list of dict): Memoized `normalize()` results: [recent generation, older generation]
+   When recent generation is full, it becomes older one, and older one is dropped (texts used within the last two
+   generations are kept, as with LRU cache, but lookups cost no more than a dict lookup)
+"""
+
+
+class TokenSpans(object):
+    """Words of a text stored as their positions and lengths in the text, so that a long text takes a few objects
+    Items are (content, position) tuples, built on access (see `split_to_words()`)
+
+    Attributes:
+        text (str or unicode): Source text
+        positions (array.array): Words' first letter positions
+        lengths (array.array): Words' lengths
+    """
+    def __init__(self, text, positions=None, lengths=None):
+        self.text = text
+        self.positions = positions if positions is not None else array('i')
+        self.lengths = lengths if lengths is not None else array('i')
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TokenSpans(self.text, self.positions[index], self.lengths[index])
+        position = self.positions[index]
+        return self.text[position:position + self.lengths[index]], position
+
+    def __iter__(self):
+        text = self.text
+        for position, length in izip(self.positions, self.lengths):
+            yield text[position:position + length], position
+
+    def get_words(self):
+        """Get words contents
+
+        Returns:
+            (list of str) or (list of unicode)
+        """
+        text = self.text
+        return [text[position:position + length] for position, length in izip(self.positions, self.lengths)]
+
+
 def split_to_words(text, include_positions=False):
     """Split provided text into words
     Adapted from: http://stackoverflow.com/a/22075070 (see also `word_chars` below)
@@ -11,73 +67,126 @@ def split_to_words(text, include_positions=False):
         include_positions (bool=False): Extend return format with words' first letter positions (see examples below)
 
     Returns:
-        (list of str) or (list of unicode) or (list of dict): Format depends on value of `include_position` argument
+        (list of str) or (list of unicode) or TokenSpans: Format depends on value of `include_position` argument
 
     Examples:
-        from twiwri import txtools
+        from bowie import txtools
         text = 'Foo, bar... Qux?'
-        txtools.split_words(text)        # -> ['Foo', 'bar', 'Qux']
-        txtools.split_words(text, True)  # -> [{'content': 'Foo', 'position': 0},
-                                         #     {'content': 'bar', 'position': 5},
-                                         #     {'content': 'Qux', 'position': 12}]
+        txtools.split_to_words(text)              # -> ['Foo', 'bar', 'Qux']
+        list(txtools.split_to_words(text, True))  # -> [('Foo', 0), ('bar', 5), ('Qux', 12)]
+    """
+    if not include_positions:
+        return word_pattern.findall(text)
+
+    spans = TokenSpans(text)
+    add_position = spans.positions.append
+    add_length = spans.lengths.append
+    for match in word_pattern.finditer(text):
+        start, end = match.span()
+        add_position(start)
+        add_length(end - start)
+    return spans
+
+
+def split_post_to_words(text, lowercase=False, normalized=False):
+    """Split post text into words in a single pass, skipping usernames and hyperlinks (see `post_word_pattern` below)
+
+    Args:
+        text (unicode): Post text
+        lowercase (bool=False): Convert words to lowercase
+        normalized (bool=False): Normalize words (see `normalize()`)
 
-    Todo:
-        Return tuples (not dicts) when include_positions=True?
+    Returns:
+        list of unicode
+
+    Examples:
+        from bowie import txtools
+        text = u'@ziggy Caf\u00E9 au lait https://t.co/AbCdEf'
+        txtools.split_post_to_words(text)                   # -> [u'Caf\u00E9', u'au', u'lait']
+        txtools.split_post_to_words(text, normalized=True)  # -> [u'cafe', u'au', u'lait']
     """
-    result = []
-    for match in re.finditer(word_chars + '+', text, re.UNICODE):
-        if include_positions:
-            result.append({
-               'content': match.group(0),
-               'position': match.start()
-            })
-        else:
-            result.append(match.group(0))
+    if lowercase and not normalized:
+        text = text.lower()
+    words = [word for word in post_word_pattern.findall(text) if word]
+    if normalized:
+        return normalize_many(words)
+    return words
+
+
+def normalize(text):
+    """Convert text to lowercase and remove diacritics (that's how searched words are matched against post words)
+    Results are memoized, up to `NORMALIZE_CACHE_SIZE` recently used ones (see `normalize_cache`)
+
+    Args:
+        text (str or unicode): Input text (`str` is decoded as UTF-8)
+
+    Returns:
+        unicode: Normalized text
+
+    Examples:
+        from bowie import txtools
+        txtools.normalize(u'Caf\u00E9')  # -> u'cafe'
+    """
+    if isinstance(text, str):
+        text = text.decode('utf8')
+
+    # Dict operations and generations swap are atomic, so concurrent fetching threads need no lock
+    recent, older = normalize_cache
+    result = recent.get(text)
+    if result is None:
+        result = older.get(text)
+        if result is None:
+            result = remove_diacritics(text.lower())
+        recent[text] = result
+        if len(recent) >= NORMALIZE_CACHE_SIZE / 2:
+            normalize_cache[:] = [{}, recent]
+    return result
+
+
+def normalize_many(texts):
+    """Normalize many texts at once: texts are joined, normalized in one pass, and split back (see `normalize()`)
+    Unlike `normalize()`, results are not memoized (batches are normalized faster than looked up one by one)
+
+    Args:
+        texts (iterable of str or unicode): Input texts (`str` is decoded as UTF-8)
+
+    Returns:
+        list of unicode: Normalized texts, aligned with input ones
+    """
+    texts = list(texts)
+    try:
+        joined = NORMALIZE_SEPARATOR.join(texts)
+    except UnicodeDecodeError:
+        joined = NORMALIZE_SEPARATOR.join(text.decode('utf8') if isinstance(text, str) else text for text in texts)
+
+    result = remove_diacritics(joined.lower()).split(NORMALIZE_SEPARATOR)
+
+    # Some text contains the separator: normalize texts one by one
+    if len(result) != len(texts):
+        return map(normalize, texts)
     return result
 
 
 def remove_diacritics(text):
     """Remove diacritic sign (accents) from provided text
-    Adapted from: http://stackoverflow.com/a/18391901/3027390 (see also `diacritics_map` and `diacritics_list` below)
+    Adapted from: http://stackoverflow.com/a/18391901/3027390 (see also `diacritics_table` and `diacritics_list` below)
 
     Args:
-        text (str): Input text
+        text (str or unicode): Input text (`str` is decoded as UTF-8)
 
     Returns:
-        str: Text with diacritic char replaced with correspondent ASCII ones
+        unicode: Text with diacritic chars replaced with correspondent ASCII ones
 
     Raises:
-        Exception: Cannot build diacritics map
         Exception: Cannot do replace
-
-    Todo:
-        Too excessive replaced char range?
     """
-    # Prepare diacritics map if empty
-    if len(diacritics_map) == 0:
-        try:
-            for item in diacritics_list:
-                for letter in item[1]:
-                    diacritics_map[letter] = item[0]
-        except Exception as ex:
-            raise Exception('Cannot build diacritics map: %s' % ex)
-
-    # Replace callback for re.sub
-    def choose(match):
-        char = match.group(0)
-        if char in diacritics_map:
-            return diacritics_map[char]
-        else:
-            return char
-
-    # Do the replace
     try:
-        result = re.sub(ur'[^\u0000-\u007E]', choose, text, re.UNICODE)
+        if isinstance(text, str):
+            text = text.decode('utf8')
+        return text.translate(diacritics_table)
     except Exception as ex:
         raise Exception('Cannot do replace: %s' % ex)
 
-    return result
-
 
 # Characters used in words
 # In our terms, number is also a "word" (i.e. the phrase "It is 40000 km long" contains 5 words)
@@ -127,6 +236,14 @@ word_chars = \
     ur'\uFB41\uFB43\uFB44\uFB46-\uFBB1\uFBD3-\uFD3D\uFD50-\uFD8F\uFD92-\uFDC7\uFDF0-\uFDFB\uFE70-\uFE74\uFE76-\uFEFC' \
     ur'\uFF21-\uFF3A\uFF41-\uFF5A\uFF66-\uFFBE\uFFC2-\uFFC7\uFFCA-\uFFCF\uFFD2-\uFFD7\uFFDA-\uFFDC]'
 
+word_pattern = re.compile(word_chars + '+', re.UNICODE)
+"""(re.RegexObject): Word matching pattern (see `split_to_words()`)"""
+
+# Usernames and hyperlinks in posts are skipped when they come after whitespace or at the text beginning
+# (pattern alternatives are tried in order, so a skipped item is never split into words)
+post_word_pattern = re.compile(ur'(?<!\S)(?:https://t\.co/\S+|@[a-zA-Z0-9_]+)|(' + word_chars + '+)', re.UNICODE)
+"""(re.RegexObject): Post tokens matching pattern, only words are captured (see `split_post_to_words()`)"""
+
 
 # Licensed under the Apache License, Version 2.0 (the 'License');
 # you may not use this file except in compliance with the License.
@@ -141,7 +258,7 @@ word_chars = \
 # limitations under the License.
 diacritics_map = {}
 """(dict of str: str): Map for diacritic symbols replacements
-   Used in `remove_diacritics()`, being built on its first call (on the basis of `diacritics_list` tuple list)
+   Built on module import on the basis of `diacritics_list` tuple list (see `diacritics_table` below)
    Format: {u'\u0041': 'A',
             u'\u24B6': 'A',
             ...
@@ -255,3 +372,16 @@ diacritics_list = [
     ('y',  ur'\u0079\u24E8\uFF59\u1EF3\u00FD\u0177\u1EF9\u0233\u1E8F\u00FF\u1EF7\u1E99\u1EF5\u01B4\u024F\u1EFF'),
     ('z',  ur'\u007A\u24E9\uFF5A\u017A\u1E91\u017C\u017E\u1E93\u1E95\u01B6\u0225\u0240\u2C6C\uA763'),
 ]
+
+diacritics_map.update((letter, replacement) for replacement, letters in diacritics_list for letter in letters)
+
+diacritics_table = range(max(ord(letter) for letter in diacritics_map) + 1)
+"""(list of int or unicode): Translation table for `unicode.translate()` used in `remove_diacritics()`
+   Built on module import from `diacritics_map`: replacement of each char is found by its codepoint, unmapped chars
+   are mapped to themselves (a list is looked up much faster than a dict), codepoints beyond the table are left as is
+   ASCII chars are left as is too (e.g. "`" is not replaced by "'")
+   Format: [0, 1, ..., 126, 127, ..., u'A', ...]
+"""
+for letter, replacement in diacritics_map.items():
+    if ord(letter) > ASCII_MAX:
+        diacritics_table[ord(letter)] = unicode(replacement)
@@ -4,105 +4,72 @@ from bowie import storage
 from bowie import twitter
 from flask import request
 import json
-import calendar
+
+
+COLLECTION_NAMES = ('recent', 'prev')
 
 
 @app.route('/api/collections/')
 def collections():
     """Return data for previous and recent tweet collections
+    Payload pre-rendered at collections shift is returned if available (when no page params given)
+
+    Query params:
+        offset (int=0): Index of the first collection item (and word) to return
+        limit (int=None): Maximum number of items to return from each collection (all items by default)
+        which (str=None): Return only given collection: 'recent' or 'prev' (both by default)
 
     Example:
         /api/collections/?rnd=1454885884221
+        /api/collections/?offset=100&limit=50&which=recent
     """
 
-    # Get words list
+    # Get page params
+    offset, limit, stop = get_page_params()
+    which = request.args.get('which')
+    if which not in COLLECTION_NAMES:
+        which = None
+
+    # Return pre-rendered payload for current collection generation
+    if offset == 0 and limit is None and which is None:
+        try:
+            payload = storage.get_payload('collections')
+        except:
+            payload = None
+        if payload is not None:
+            return payload
+
+    # Get words list page
     try:
-        words = storage.get_words()
+        words = storage.get_words(offset, stop)
     except:
         return api_error('Storage error when getting words list', 301)
 
-    # Get recent collection
-    try:
-        recent_data = storage.get_recent_collection()
-    except:
-        recent_data = []
-
-    # Get prev collection
+    # Get recent collection page
+    recent_data = None
+    if which in (None, 'recent'):
+        try:
+            recent_data = storage.get_recent_collection(offset, stop)
+        except:
+            recent_data = []
+
+    # Get prev collection page
+    prev_data = None
+    if which in (None, 'prev'):
+        try:
+            prev_data = storage.get_prev_collection(offset, stop)
+        except:
+            prev_data = []
+
+    # Build collections data
     try:
-        prev_data = storage.get_prev_collection()
-    except:
-        prev_data = []
-
-    result = {
-        'recent': [],
-        'prev': [],
-    }
-
-    # List tweets data
-    for key, data in {'recent': recent_data, 'prev': prev_data}.items():
-
-        for i, item in enumerate(data):
-
-            # Parse tweet data
-            try:
-                tweet_data = json.loads(item)
-            except:
-                return api_error('Tweet data error', 400)
-
-            # Build tweet URL
-            try:
-                tweet_url = twitter.get_tweet_url(tweet_data)
-            except:
-                return api_error('Tweet data error', 401)
-
-            # Get tweet author screen name
-            try:
-                tweet_author = tweet_data['user']['screen_name']
-            except:
-                return api_error('Tweet data error', 402)
-
-            # Parse and format tweet time
-            try:
-                tweet_time_struct = twitter.parse_twitter_time(tweet_data['created_at'])
-                tweet_timestamp = int(calendar.timegm(tweet_time_struct))
-                tweet_time = twitter.get_formatted_datetime(tweet_time_struct)
-            except:
-                return api_error('Tweet data error', 403)
-
-            # Get tweet text
-            try:
-                tweet_content = tweet_data['text']
-            except:
-                return api_error('Tweet data error', 404)
-
-            # Get tweet hashtags
-            try:
-                tweet_hashtags = []
-                for hashtag_data in tweet_data['entities']['hashtags']:
-                    tweet_hashtags.append('#' + hashtag_data['text'])
-            except:
-                return api_error('Tweet data error', 405)
-
-            # Prevent broken collection response if words changed recently
-            try:
-                word = words[i]
-            except:
-                word = '(Unknown)'
-
-            # Append item to results list
-            result[key].append({
-                'word': word,
-                'tweet_url': tweet_url,
-                'tweet_author': tweet_author,
-                'tweet_time': tweet_time,
-                'tweet_timestamp': tweet_timestamp,
-                'tweet_content': tweet_content,
-                'tweet_hashtags': tweet_hashtags,
-            })
+        result = twitter.build_collections(words, recent_data, prev_data)
+    except twitter.TweetDataError as ex:
+        return api_error(str(ex), ex.code)
 
     # Output JSON results
     try:
-        return json.dumps(result, ensure_ascii=False).encode('utf8')
+        return twitter.encode_payload(result)
     except:
         return api_error('Result output error', 500)
 
@@ -110,6 +77,7 @@ def collections():
 @app.route('/api/stat/')
 def stat():
     """Return statistical data for previous and recent tweet collections
+    Payload pre-rendered at collections shift is returned if available (for default `slowest` value)
 
     Example:
         /api/stat/
@@ -122,7 +90,16 @@ def stat():
         if slowest < 1:
             raise ValueError
     except:
-        slowest = 5
+        slowest = twitter.STAT_SLOWEST_DEFAULT
+
+    # Return pre-rendered payload for current collection generation
+    if slowest == twitter.STAT_SLOWEST_DEFAULT:
+        try:
+            payload = storage.get_payload('stat')
+        except:
+            payload = None
+        if payload is not None:
+            return payload
 
     # Get words list
     try:
@@ -142,82 +119,138 @@ def stat():
     except:
         prev_data = []
 
-    # Output data
-    result = {}
-
-    # Process tweets data
-    for key, data in {'recent': recent_data, 'prev': prev_data}.items():
-
-        prev_tweet_timestamp = None
-        tweets_data = []
-
-        for i, item in enumerate(data):
-
-            # Parse tweet data
-            try:
-                tweet_data = json.loads(item)
-            except:
-                return api_error('Tweet data error', 400)
-
-            # Build tweet URL
-            try:
-                tweet_url = twitter.get_tweet_url(tweet_data)
-            except:
-                return api_error('Tweet data error', 401)
-
-            # Parse and format tweet time
-            try:
-                tweet_time_struct = twitter.parse_twitter_time(tweet_data['created_at'])
-                tweet_timestamp = int(calendar.timegm(tweet_time_struct))
-                tweet_time = twitter.get_formatted_datetime(tweet_time_struct)
-            except:
-                return api_error('Tweet data error', 403)
-
-            # Get tweet hashtags
-            try:
-                tweet_hashtags = []
-                for hashtag_data in tweet_data['entities']['hashtags']:
-                    tweet_hashtags.append('#' + hashtag_data['text'])
-            except:
-                return api_error('Tweet data error', 405)
-
-            # Consider first tweet was collected immediately (no prev tweet data)
-            if i == 0:
-                prev_tweet_timestamp = tweet_timestamp
-
-            # Prevent broken collection response if words changed recently
-            try:
-                word = words[i]
-            except:
-                word = '(Unknown)'
-
-            # Append item to results list
-            tweets_data.append({
-                'word': word + ' (#%d)' % i,
-                'tweet_url': tweet_url,
-                'tweet_hashtags': tweet_hashtags,
-                'tweet_time': tweet_time,
-                'tweet_timestamp': tweet_timestamp,
-                'tweet_time_delta': tweet_timestamp - prev_tweet_timestamp,
+    # Build statistical data
+    try:
+        result = twitter.build_stat(words, recent_data, prev_data, slowest)
+    except twitter.TweetDataError as ex:
+        return api_error(str(ex), ex.code)
+
+    # Output JSON results
+    try:
+        return twitter.encode_payload(result)
+    except:
+        return api_error('Result output error', 500)
+
+
+@app.route('/api/archive/')
+def archive():
+    """Return list of available collection generations: recent, previous and archived ones (newest first)
+
+    Example:
+        /api/archive/
+    """
+
+    # Get current generation
+    try:
+        generation = storage.get_generation()
+    except:
+        return api_error('Storage error when getting collection generation', 302)
+
+    # Get archived generations
+    try:
+        archived = storage.get_archive()
+    except:
+        return api_error('Storage error when getting collections archive', 303)
+
+    result = {
+        'generations': [],
+    }
+
+    # List recent and previous collections
+    for key, item_generation in (('recent', generation), ('prev', generation - 1)):
+        if item_generation > 0:
+            result['generations'].append({
+                'generation': item_generation,
+                'collection': key,
+                'archived_at': None,
             })
 
-            prev_tweet_timestamp = tweet_timestamp
+    # List archived collections
+    for item_generation, archived_at in archived:
+        result['generations'].append({
+            'generation': item_generation,
+            'collection': 'archive',
+            'archived_at': archived_at,
+        })
+
+    # Output JSON results
+    try:
+        return twitter.encode_payload(result)
+    except:
+        return api_error('Result output error', 500)
+
+
+@app.route('/api/archive/<int:generation>/')
+def archive_collection(generation):
+    """Return data for tweet collection of given generation (recent, previous or archived one)
+    Words are taken from the current words list
+
+    Query params:
+        offset (int=0): Index of the first collection item (and word) to return
+        limit (int=None): Maximum number of items to return (all items by default)
+
+    Example:
+        /api/archive/12/
+        /api/archive/12/?offset=100&limit=50
+    """
+
+    # Get page params
+    offset, limit, stop = get_page_params()
 
-        # Save result item
-        result[key] = {
-            'first_tweet_time': tweets_data[0]['tweet_time'],
-            'last_tweet_time': tweets_data[-1]['tweet_time'],
-            'collect_duration': tweets_data[-1]['tweet_timestamp'] - tweets_data[0]['tweet_timestamp'],
-            'slowest_words': list(sorted(tweets_data, key=lambda item: -item['tweet_time_delta'])[:slowest]),
-        }
+    # Get collection page
+    try:
+        data = storage.get_generation_collection(generation, offset, stop)
+    except:
+        return api_error('Storage error when getting collection', 304)
+    if data is None:
+        return api_error('Collection not found', 404, 404)
+
+    # Get words list page
+    try:
+        words = storage.get_words(offset, stop)
+    except:
+        return api_error('Storage error when getting words list', 301)
+
+    # Build collection data
+    try:
+        result = twitter.build_collections(words, data)
+    except twitter.TweetDataError as ex:
+        return api_error(str(ex), ex.code)
 
     # Output JSON results
     try:
-        return json.dumps(result, ensure_ascii=False).encode('utf8')
+        return twitter.encode_payload({
+            'generation': generation,
+            'collection': result['recent'],
+        })
     except:
         return api_error('Result output error', 500)
 
 
+def get_page_params():
+    """Get collection page params from request query
+
+    Returns:
+        int: Index of the first item (`offset` query param, 0 by default)
+        int or None: Maximum number of items (`limit` query param, None means no limit)
+        int: Index of the last item, inclusive (-1 means the end of the list)
+    """
+    try:
+        offset = int(request.args.get('offset'))
+        if offset < 0:
+            raise ValueError
+    except:
+        offset = 0
+    try:
+        limit = int(request.args.get('limit'))
+        if limit < 1:
+            raise ValueError
+    except:
+        limit = None
+    stop = offset + limit - 1 if limit is not None else -1
+    return offset, limit, stop
+
+
 def api_error(error_message, error_code, http_code=500):
     """Output error JSON for API command
 
@@ -1,16 +1,38 @@
 """Command line tool to assemble pre-saved text with sequential tweets fetched
 
+Interrupted process is resumed from its checkpoint, unless `--fresh` option is given
+With `--stream` option, tweets are received from the stream instead of search requests (see `bowie.stream`)
+
 Example:
     python collect.py
+    python collect.py --fresh
+    python collect.py --stream tcp://127.0.0.1:9999
+    python collect.py --stream file:///path/to/tweets.ndjson?interval=0.1
 """
 import os
 import sys
 import time
+import argparse
 from bowie import twitter
+from bowie import stream
 
 
 LOCKFILE_PATH = './collect.py.LOCK'
 
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Assemble pre-saved text with sequential tweets fetched')
+parser.add_argument('--fresh', action='store_true', help='start from scratch, discarding interrupted process progress')
+parser.add_argument('--stream', metavar='URL', help='collect from tweets stream (file or tcp://host:port URL)')
+args = parser.parse_args()
+
+# Open tweets stream
+transport = None
+if args.stream:
+    try:
+        transport = stream.open_stream(args.stream)
+    except ValueError as ex:
+        parser.error(str(ex))
+
 # Check if lockfile exists
 if os.path.exists(LOCKFILE_PATH):
     filetime = os.path.getmtime(LOCKFILE_PATH)
@@ -33,7 +55,7 @@ except BaseException as ex:
     sys.exit(102)
 
 # Start assemble process
-twitter.assemble_collection()
+twitter.assemble_collection(resume=not args.fresh, stream=transport)
 
 # Remove lockfile when finished
 os.remove(LOCKFILE_PATH)
@@ -1,12 +1,17 @@
-"""Command line tool to parse text into words and store it to redis, replacing any previously saved words set
+"""Command line tool to parse text into words and store it, replacing any previously saved words set
+File is read and stored in chunks, so a text of any length can be imported (see `storage.import_words()`),
+previous words set is replaced once all words are written and confirmed (or right away with `--yes`)
 
 Example:
-    python add.py <filename>
+    python parse.py <filename>
+    python parse.py --yes <filename>
 """
 from bowie import storage
 from bowie import txtools
+import argparse
 import sys
 import io
+import time
 
 
 def prompt_if_is_correct(filename, words_count):
@@ -33,41 +38,86 @@ def prompt_if_is_correct(filename, words_count):
         return prompt_if_is_correct(filename, words_count)
 
 
-# Get filename
-try:
-    filename = sys.argv[1]
-except:
-    print('Usage: python parse.py <filename>\n')
-    sys.exit(100)
+def read_words(f):
+    """Split file content into words line by line (words never span lines)
+
+    Args:
+        f (io.TextIOWrapper): Input file
+
+    Returns:
+        iterable of unicode
+    """
+    try:
+        for line in f:
+            for word in txtools.split_to_words(line):
+                yield word
+    except Exception as ex:
+        read_errors.append(ex)
+        raise
+
 
-# Read file content
+def report_progress(words_count):
+    """Print number of words written so far and import throughput
+
+    Args:
+        words_count (int): Number of words written
+    """
+    elapsed = time.time() - time_begin
+    sys.stdout.write('\r%d words written (%d words/s)' % (words_count, words_count / elapsed if elapsed > 0 else 0))
+    sys.stdout.flush()
+
+
+def confirm(words_count):
+    """Confirm replacing previous words set (see `prompt_if_is_correct()`)
+
+    Args:
+        words_count (int): Number of words in the text
+
+    Returns:
+        boolean
+    """
+    global time_written
+    time_written = time.time()
+    print('')
+    return args.yes or prompt_if_is_correct(args.filename, words_count)
+
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Parse text into words and store it, replacing previous words set')
+parser.add_argument('filename', help='text file (UTF-8)')
+parser.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+args = parser.parse_args()
+
+# Open file
 try:
-    with io.open(filename, 'r', encoding='utf-8') as f:
-        content = f.read()
+    f = io.open(args.filename, 'r', encoding='utf-8')
 except:
-    print('Cannot read file: %s; aborting.\n' % filename)
+    print('Cannot read file: %s; aborting.\n' % args.filename)
     sys.exit(200)
 
-# Parse file content into components
+# Parse file content into words and save them to database
+read_errors = []
+time_begin = time_written = time.time()
 try:
-    words = txtools.split_to_words(content)
-except:
-    print('Cannot parse contents of file: %s; aborting.\n' % filename)
-    sys.exit(201)
+    with f:
+        words_count = storage.import_words(read_words(f), confirm, report_progress)
+except (KeyboardInterrupt, EOFError):
+    print('\nInterrupted by user, previous words list is kept.\n')
+    sys.exit(102)
+except BaseException as ex:
+    if read_errors:
+        print('\nCannot parse contents of file: %s (%s); aborting.\n' % (args.filename, read_errors[0]))
+        sys.exit(201)
+    print('\nStorage error while saving words list: %s; aborting.\n' % ex)
+    sys.exit(301)
 
-# Prompt user if results are correct
-if not prompt_if_is_correct(filename, len(words)):
+if words_count is None:
     print('Aborted by user.\n')
     sys.exit(101)
 
-# Save text item to database
-try:
-    storage.set_words(words)
-except BaseException as ex:
-    print('Storage error while saving words list: %s; aborting.\n' % ex)
-    sys.exit(301)
-
 # Report success
+elapsed = time_written - time_begin
 print('\n====================')
 print('New words list stored successfully')
+print('%d words written in %.2f s (%d words/s)' % (words_count, elapsed, words_count / elapsed if elapsed > 0 else 0))
 print('====================\n')
@@ -7,7 +7,7 @@ setup(name='pingwithbowie',
       author_email='evgeni@odditystudio.com',
       url='http://www.python.org/sigs/distutils-sig/',
       install_requires=[
-          'redis',
+          'redis>=3.3',
           'twython',
           'flask',
           'requests>=2.9.1',
@@ -0,0 +1,27 @@
+"""Command line tool replaying tweets from NDJSON file over TCP, standing in for Twitter streaming API
+Each connected client receives the whole file (see `bowie.stream.serve()`)
+
+Example:
+    python stream_replay.py data/tweets.ndjson
+    python stream_replay.py data/tweets.ndjson --port 9999 --interval 0.5
+"""
+import argparse
+from bowie import stream
+
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Replay tweets from NDJSON file over TCP')
+parser.add_argument('path', help='NDJSON file path (one tweet per line)')
+parser.add_argument('--host', default='127.0.0.1', help='address to listen at')
+parser.add_argument('--port', type=int, default=9999, help='port to listen at')
+parser.add_argument('--interval', type=float, default=stream.REPLAY_INTERVAL_DEFAULT,
+                    help='delay between tweets, in seconds')
+parser.add_argument('--keep-time', action='store_true', help='keep recorded tweets time instead of replay time')
+args = parser.parse_args()
+
+# Serve until interrupted
+print('Replaying %s at %s:%d' % (args.path, args.host, args.port))
+try:
+    stream.serve(args.path, args.host, args.port, args.interval, retime=not args.keep_time)
+except KeyboardInterrupt:
+    pass
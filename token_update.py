@@ -1,20 +1,43 @@
+"""Command line tool to obtain new Twitter access tokens and save them to config file
+
+Tokens are updated for all configured credential sets (`twitter` config section and `twitter:*` ones),
+unless credential set names are given
+
+Example:
+    python token_update.py
+    python token_update.py twitter:backup
+"""
 from bowie import config
 from bowie import twitter
+import argparse
 
 
-# Obtain twitter access token
-try:
-    token = twitter.get_token()
-    print('\nTwitter token obtained:')
-    print('=' * len(token))
-    print(token)
-    print('=' * len(token))
-except BaseException as ex:
-    raise Exception('Cannot obtain twitter access token: %s' % ex)
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Obtain new Twitter access tokens and save them to config file')
+parser.add_argument('names', nargs='*', help='credential set names (all configured ones by default)')
+args = parser.parse_args()
 
-# Save token to config file
+# Get credential sets to update
 try:
-    config.save_param('twitter', 'access_token', token)
-    print('Token stored successfully (config file)')
+    names = args.names or twitter.get_credential_names()
 except BaseException as ex:
-    raise Exception('Cannot obtain new twitter access token: %s' % ex)
+    raise Exception('Cannot get twitter credentials: %s' % ex)
+
+for name in names:
+
+    # Obtain twitter access token
+    try:
+        token = twitter.get_token(name)
+        print('\nTwitter token obtained (%s):' % name)
+        print('=' * len(token))
+        print(token)
+        print('=' * len(token))
+    except BaseException as ex:
+        raise Exception('Cannot obtain twitter access token: %s' % ex)
+
+    # Save token to config file
+    try:
+        config.save_param(name, 'access_token', token)
+        print('Token stored successfully (config file)')
+    except BaseException as ex:
+        raise Exception('Cannot obtain new twitter access token: %s' % ex)